@@ -0,0 +1,26 @@
+"""
+Response classes shared by the API routes.
+"""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class OrjsonResponse(JSONResponse):
+    """
+    JSON response rendered with orjson.
+
+    It is the application's default response class, so every route's JSON is
+    rendered by orjson. Routes also return this directly for trusted payloads (data we produced and
+    stored ourselves) so FastAPI skips the outbound response_model validation
+    pass; the response_model is still declared on the route for the docs.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
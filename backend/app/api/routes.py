@@ -11,7 +11,7 @@ import pandas as pd
 from datetime import datetime
 from openpyxl import Workbook
 
-from fastapi import APIRouter, HTTPException, Response, UploadFile, File, Header
+from fastapi import APIRouter, HTTPException, Response, UploadFile, File, Header, Query
 from fastapi.responses import StreamingResponse
 from typing import Annotated
 
@@ -29,14 +29,15 @@ from ..models.schemas import (
 from ..services.calculator import calculate_salary
 from ..services.excel_parser import parse_excel_file
 from ..services.payslip_excel_generator import generate_payslip_excel
-from ..services.batch_payslip_generator import generate_batch_payslip_zip
-from ..services.excel_exporter import export_employees_to_excel
+from ..services.batch_payslip_generator import iter_batch_payslip_zip, payslip_filename, safe_filename_part
+from ..services.excel_exporter import export_employees_to_excel, export_records_to_excel
 from ..services.employee_service import employee_service
 from ..services.user_service import user_service
 from ..services.encryption_service import encryption_service
 from ..services.payroll_service import payroll_service
 from ..storage.mem import storage
-from pydantic import BaseModel, EmailStr
+from .responses import OrjsonResponse
+from pydantic import BaseModel, EmailStr, TypeAdapter
 
 # Create router with /api prefix
 router = APIRouter(prefix="/api")
@@ -198,8 +199,9 @@ async def get_payroll_employees(
     
     try:
         employees = payroll_service.load_payroll_employees(x_username, x_password)
-        # Convert dict to SelectEmployee models
-        return [SelectEmployee(**emp) for emp in employees]
+        # Stored records were produced by our own calculator, so serialize the
+        # dicts directly instead of re-validating each one as SelectEmployee
+        return OrjsonResponse(content=employees)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -248,6 +250,8 @@ async def create_payroll_employee(
             status_code=400,
             detail={"message": "Invalid employee data", "errors": [str(e)]}
         )
+    except PermissionError:
+        raise HTTPException(status_code=401, detail={"message": "Failed to decrypt payroll data. Wrong password or corrupt file."})
     except HTTPException:
         raise
     except Exception as e:
@@ -566,6 +570,8 @@ async def update_payroll_employee(
             status_code=400,
             detail={"message": "Invalid employee data", "errors": [str(e)]}
         )
+    except PermissionError:
+        raise HTTPException(status_code=401, detail={"message": "Failed to decrypt payroll data. Wrong password or corrupt file."})
     except HTTPException:
         raise
     except Exception as e:
@@ -605,6 +611,8 @@ async def delete_payroll_employee(
             )
         # Return 204 No Content on successful deletion
         return Response(status_code=204)
+    except PermissionError:
+        raise HTTPException(status_code=401, detail={"message": "Failed to decrypt payroll data. Wrong password or corrupt file."})
     except HTTPException:
         raise
     except Exception as e:
@@ -643,6 +651,8 @@ async def clear_all_payroll_employees(
             "message": f"Successfully cleared {deleted_count} payroll employees",
             "deleted": deleted_count
         }
+    except PermissionError:
+        raise HTTPException(status_code=401, detail={"message": "Failed to decrypt payroll data. Wrong password or corrupt file."})
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -769,17 +779,10 @@ async def download_payslip_excel(calculation_data: dict):
         # Get employee name for filename, with fallback
         employee_name = calculation_data.get('name', 'Employee')
         
-        # Create ASCII-safe filename for compatibility
-        import unicodedata
-        import re
-        
-        # Convert Vietnamese characters to ASCII equivalents
-        ascii_name = unicodedata.normalize('NFKD', employee_name)
-        ascii_name = ''.join(c for c in ascii_name if not unicodedata.combining(c))
-        # Clean filename - keep only alphanumeric, spaces, hyphens, underscores
-        safe_name = re.sub(r'[^\w\s-]', '', ascii_name).strip()
-        safe_name = re.sub(r'[-\s]+', '_', safe_name)
-        filename = f"Payslip_{safe_name}.xlsx"
+        # Create ASCII-safe filename for compatibility (Vietnamese characters
+        # converted to ASCII equivalents, the employee number if none are left)
+        employee_no = safe_filename_part(str(calculation_data.get('employeeNo') or ''), 'Employee')
+        filename = f"Payslip_{safe_filename_part(employee_name, employee_no)}.xlsx"
         
         # Create proper Content-Disposition header with both ASCII and UTF-8 versions
         from urllib.parse import quote
@@ -848,26 +851,14 @@ async def download_all_payslips_excel(
         # Convert to SelectEmployee models
         employees = [SelectEmployee(**emp) for emp in employees_dict]
         
-        # Generate ZIP file with all pay slips
-        zip_bytes = generate_batch_payslip_zip(employees)
-        
-        if not zip_bytes:
-            raise HTTPException(
-                status_code=500,
-                detail={"message": "Failed to generate any pay slip files"}
-            )
-        
         # Create filename with current date
         from datetime import datetime
         current_date = datetime.now().strftime("%Y%m%d")
         filename = f"All_Payslips_{current_date}.zip"
         
-        # Return ZIP file as download
-        def generate():
-            yield zip_bytes
-            
+        # Stream the ZIP file as pay slips are generated
         return StreamingResponse(
-            generate(),
+            iter_batch_payslip_zip(employees),
             media_type="application/zip",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
@@ -926,7 +917,8 @@ async def download_complete_payroll(
         # Create a BytesIO object to hold the ZIP file
         zip_buffer = io.BytesIO()
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        # .xlsx files are already deflated, so store them without recompressing
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED, allowZip64=True) as zip_file:
             # 1. Add all payslips to the ZIP
             for employee in employees:
                 try:
@@ -936,18 +928,9 @@ async def download_complete_payroll(
                     # Generate payslip Excel for this employee
                     payslip_bytes = generate_payslip_excel(employee_dict)
                     
-                    # Create safe filename
-                    import unicodedata
-                    import re
-                    employee_name = employee.name
-                    ascii_name = unicodedata.normalize('NFKD', employee_name)
-                    ascii_name = ''.join(c for c in ascii_name if not unicodedata.combining(c))
-                    safe_name = re.sub(r'[^\w\s-]', '', ascii_name).strip()
-                    safe_name = re.sub(r'[-\s]+', '_', safe_name)
-                    
                     # Add to ZIP in payslips folder
                     zip_file.writestr(
-                        f"Payslips/Payslip_{safe_name}.xlsx",
+                        f"Payslips/{payslip_filename(employee)}",
                         payslip_bytes
                     )
                 except Exception as e:
@@ -992,6 +975,41 @@ async def download_complete_payroll(
 
 # ============ Dashboard Employee Management Endpoints (nhan_vien.json) ============
 
+# Shapes an employee exactly like response_model=EmployeeSphere, but validates
+# and serializes to JSON bytes in one pass
+_EMPLOYEE_ADAPTER = TypeAdapter(EmployeeSphere)
+
+def _encode_employee(employee: dict) -> bytes:
+    """One stored employee as its /employees JSON object"""
+    return _EMPLOYEE_ADAPTER.dump_json(_EMPLOYEE_ADAPTER.validate_python(employee))
+
+def _filtered_employees(
+    department: Optional[str],
+    position: Optional[str],
+    contract_type: Optional[str],
+    gender: Optional[str],
+    search: Optional[str],
+    min_age: Optional[int],
+    max_age: Optional[int],
+    x_username: Optional[str],
+    x_password: Optional[str]
+) -> List[dict]:
+    """Employees of the authenticated user matching the filters, as stored."""
+    # Get auth from headers
+    if not x_username or not x_password:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    return employee_service.filter_employees(
+        x_username, x_password,
+        department=department,
+        position=position,
+        contract_type=contract_type,
+        gender=gender,
+        search=search,
+        min_age=min_age,
+        max_age=max_age,
+    )
+
 @router.get("/employees", response_model=List[EmployeeSphere])
 def get_employees(
     department: Optional[str] = None,
@@ -1001,74 +1019,42 @@ def get_employees(
     search: Optional[str] = None,
     min_age: Optional[int] = None,
     max_age: Optional[int] = None,
+    page: Annotated[int, Query(ge=0)] = 0,
+    page_size: Annotated[int | None, Query(ge=1)] = None,
     x_username: Annotated[str | None, Header()] = None,
     x_password: Annotated[str | None, Header()] = None
 ):
-    """Get employees for the authenticated user."""
+    """
+    Get employees for the authenticated user.
+    
+    Without page_size the whole filtered list is returned. With it, only
+    that page (page is 0-based) is returned, and the X-Total-Count header
+    carries the number of matching employees.
+    """
     # Get auth from headers
     if not x_username or not x_password:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    employees = employee_service.load_employees(x_username, x_password)
+    # Only the requested page is validated and encoded, each employee once
+    # per version of the data; later requests reuse the cached JSON objects
+    window = slice(None) if page_size is None else slice(page * page_size, (page + 1) * page_size)
+    total, employees = employee_service.filter_employees_encoded(
+        x_username, x_password, _encode_employee, window,
+        department=department,
+        position=position,
+        contract_type=contract_type,
+        gender=gender,
+        search=search,
+        min_age=min_age,
+        max_age=max_age,
+    )
     
-    # Helper function to calculate age from DOB
-    def calculate_age(dob_str):
-        if not dob_str:
-            return None
-        try:
-            from datetime import datetime
-            dob = datetime.strptime(dob_str, '%Y-%m-%d')
-            today = datetime.now()
-            age = today.year - dob.year
-            if today.month < dob.month or (today.month == dob.month and today.day < dob.day):
-                age -= 1
-            return age
-        except (ValueError, TypeError):
-            return None
-    
-    
-    # Apply filters
-    filtered_employees = []
-    for emp in employees:
-        # Department filter
-        if department and emp.get("department", "").lower() != department.lower():
-            continue
-        
-        # Position filter
-        if position and position.lower() not in emp.get("position", "").lower():
-            continue
-            
-        # Contract type filter
-        if contract_type and emp.get("contract_type", "").lower() != contract_type.lower():
-            continue
-            
-        # Gender filter
-        if gender and emp.get("gender", "").lower() != gender.lower():
-            continue
-            
-            
-        # Search filter (searches in employee name only)
-        if search:
-            search_lower = search.lower()
-            emp_name = emp.get("full_name", "").lower()
-            if search_lower not in emp_name:
-                continue
-        
-        # Age filters
-        if min_age is not None or max_age is not None:
-            emp_age = calculate_age(emp.get("dob"))
-            if emp_age is None:
-                continue  # Skip employees with invalid DOB
-            
-            if min_age is not None and emp_age < min_age:
-                continue
-                
-            if max_age is not None and emp_age > max_age:
-                continue
-        
-        filtered_employees.append(emp)
+    headers = None if page_size is None else {"X-Total-Count": str(total)}
     
-    return filtered_employees
+    # Returning a Response skips FastAPI's validate -> to-Python -> encode
+    # pipeline; joined, the objects are the same JSON as the whole list's
+    body = b"[" + b",".join(employees) + b"]"
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/employees/{employee_id}")
 def get_employee(
@@ -1080,10 +1066,9 @@ def get_employee(
     if not x_username or not x_password:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    employees = employee_service.load_employees(x_username, x_password)
-    for emp in employees:
-        if emp.get("Id_number") == employee_id:
-            return emp
+    emp = employee_service.get_employee_by_id_number(x_username, x_password, employee_id)
+    if emp is not None:
+        return emp
     raise HTTPException(status_code=404, detail="Employee not found")
 
 @router.post("/employees", response_model=EmployeeSphere)
@@ -1096,16 +1081,6 @@ def create_employee(
     if not x_username or not x_password:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    employees = employee_service.load_employees(x_username, x_password)
-    
-    # Check if employee with same ID already exists
-    for emp in employees:
-        if emp.get("Id_number") == employee.Id_number:
-            raise HTTPException(status_code=400, detail="Employee with this ID already exists")
-    
-    # Generate contract ID (simple implementation)
-    contract_id = f"{len(employees)+1:02d}-{datetime.now().strftime('%m%Y')}/HĐLĐ/KXĐ"
-    
     # Create new employee
     new_employee = {
         "full_name": employee.full_name,
@@ -1118,7 +1093,7 @@ def create_employee(
         "education_level": employee.education_level,
         "department": employee.department,
         "position": employee.position,
-        "contract_id": contract_id,
+        "contract_id": None,  # numbered by add_employee
         "contract_type": employee.contract_type,
         "contract_sign_date": employee.contract_sign_date,
         "salary": employee.salary,
@@ -1131,10 +1106,18 @@ def create_employee(
         "training_skills": employee.training_skills
     }
     
-    employees.append(new_employee)
-    employee_service.save_employees(x_username, x_password, employees)
+    # Checked and saved as one step, so concurrent creates can't both pass
+    # the duplicate check or overwrite each other
+    try:
+        stored = employee_service.add_employee(x_username, x_password, new_employee)
+    except PermissionError:
+        raise HTTPException(status_code=401, detail="Failed to decrypt data. Wrong password or corrupt file.")
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to save changes")
+    if stored is None:
+        raise HTTPException(status_code=400, detail="Employee with this ID already exists")
     
-    return new_employee
+    return stored
 
 @router.put("/employees/{employee_id}")
 def update_employee(
@@ -1147,36 +1130,38 @@ def update_employee(
     if not x_username or not x_password:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    employees = employee_service.load_employees(x_username, x_password)
+    updated_data = {
+        "full_name": employee.full_name,
+        "dob": employee.dob,
+        "gender": employee.gender,
+        "address": employee.address,
+        "current_address": employee.current_address,
+        "phone": employee.phone,
+        "education_level": employee.education_level,
+        "department": employee.department,
+        "position": employee.position,
+        "contract_type": employee.contract_type,
+        "contract_sign_date": employee.contract_sign_date,
+        "salary": employee.salary,
+        "tax_code": employee.tax_code,
+        "social_insurance_number": employee.social_insurance_number,
+        "medical_insurance_hospital": employee.medical_insurance_hospital,
+        "bank_account": employee.bank_account,
+        "pvi_care": employee.pvi_care,
+        "training_skills": employee.training_skills
+    }
     
-    for i, emp in enumerate(employees):
-        if emp.get("Id_number") == employee_id:
-            # Update employee data
-            employees[i].update({
-                "full_name": employee.full_name,
-                "dob": employee.dob,
-                "gender": employee.gender,
-                "address": employee.address,
-                "current_address": employee.current_address,
-                "phone": employee.phone,
-                "education_level": employee.education_level,
-                "department": employee.department,
-                "position": employee.position,
-                "contract_type": employee.contract_type,
-                "contract_sign_date": employee.contract_sign_date,
-                "salary": employee.salary,
-                "tax_code": employee.tax_code,
-                "social_insurance_number": employee.social_insurance_number,
-                "medical_insurance_hospital": employee.medical_insurance_hospital,
-                "bank_account": employee.bank_account,
-                "pvi_care": employee.pvi_care,
-                "training_skills": employee.training_skills
-            })
-            
-            employee_service.save_employees(x_username, x_password, employees)
-            return employees[i]
+    # Update employee data (loaded, changed and saved as one step)
+    try:
+        updated = employee_service.update_employee(x_username, x_password, employee_id, updated_data)
+    except PermissionError:
+        raise HTTPException(status_code=401, detail="Failed to decrypt data. Wrong password or corrupt file.")
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to save changes")
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Employee not found")
     
-    raise HTTPException(status_code=404, detail="Employee not found")
+    return updated
 
 @router.delete("/employees/{employee_id}")
 def delete_employee(
@@ -1189,22 +1174,16 @@ def delete_employee(
         raise HTTPException(status_code=401, detail="Authentication required")
     
     try:
-        employees = employee_service.load_employees(x_username, x_password)
-        
-        # Find and remove the employee
-        initial_count = len(employees)
-        employees = [emp for emp in employees if emp.get("Id_number") != employee_id]
-        
-        if len(employees) == initial_count:
-            # No employee was removed
+        # Remove the employee (every entry with this ID) and save, as one step
+        if not employee_service.delete_employee(x_username, x_password, employee_id):
+            # No employee to remove
             raise HTTPException(status_code=404, detail="Employee not found")
         
-        # Save the updated list
-        success = employee_service.save_employees(x_username, x_password, employees)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to save changes")
-        
         return {"message": "Employee deleted successfully"}
+    except PermissionError:
+        raise HTTPException(status_code=401, detail="Failed to decrypt data. Wrong password or corrupt file.")
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to save changes")
     except HTTPException:
         raise
     except Exception as e:
@@ -1266,48 +1245,23 @@ def get_statistics(
     if not x_username or not x_password:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    employees = employee_service.load_employees(x_username, x_password)
-    
-    if not employees:
-        return {
-            "total_employees": 0,
-            "departments": {},
-            "positions": {},
-            "contract_types": {},
-            "average_salary": 0,
-            "salary_ranges": {}
-        }
-    
-    df = pd.DataFrame(employees)
-    
-    # Department distribution
-    dept_counts = df['department'].value_counts().to_dict()
-    
-    # Position distribution
-    position_counts = df['position'].value_counts().to_dict()
-    
-    # Contract type distribution
-    contract_counts = df['contract_type'].value_counts().to_dict()
-    
-    # Salary statistics
-    avg_salary = df['salary'].mean()
-    
-    # Salary ranges
-    salary_ranges = {
-        "0-10M": len(df[df['salary'] < 10000000]),
-        "10M-20M": len(df[(df['salary'] >= 10000000) & (df['salary'] < 20000000)]),
-        "20M-30M": len(df[(df['salary'] >= 20000000) & (df['salary'] < 30000000)]),
-        "30M+": len(df[df['salary'] >= 30000000])
-    }
-    
-    return {
-        "total_employees": len(employees),
-        "departments": dept_counts,
-        "positions": position_counts,
-        "contract_types": contract_counts,
-        "average_salary": int(avg_salary),
-        "salary_ranges": salary_ranges
-    }
+    return employee_service.get_statistics(x_username, x_password)
+
+def _iter_csv_rows(rows: List[dict]):
+    """
+    Yield a CSV of rows one line at a time: a header with every key in
+    first-seen order, then one line per row (missing values left empty).
+    """
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
 
 @router.get("/export/csv")
 def export_csv(
@@ -1323,21 +1277,15 @@ def export_csv(
 ):
     """Export employees to CSV for authenticated user."""
     # Get filtered employees with authentication
-    employees = get_employees(department, position, contract_type, gender, 
-                             search, min_age, max_age, x_username, x_password)
+    employees = _filtered_employees(department, position, contract_type, gender,
+                                    search, min_age, max_age, x_username, x_password)
     
     if not employees:
         raise HTTPException(status_code=404, detail="No employees found with the given filters")
     
-    # Convert to DataFrame and CSV
-    df = pd.DataFrame(employees)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False, encoding='utf-8')
-    
-    # Return as streaming response
-    csv_content = csv_buffer.getvalue()
+    # Stream the CSV row by row
     return StreamingResponse(
-        io.StringIO(csv_content),
+        _iter_csv_rows(employees),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=employees.csv"}
     )
@@ -1356,20 +1304,14 @@ def export_excel(
 ):
     """Export employees to Excel for authenticated user."""
     # Get filtered employees with authentication
-    employees = get_employees(department, position, contract_type, gender, 
-                             search, min_age, max_age, x_username, x_password)
+    employees = _filtered_employees(department, position, contract_type, gender,
+                                    search, min_age, max_age, x_username, x_password)
     
     if not employees:
         raise HTTPException(status_code=404, detail="No employees found with the given filters")
     
-    # Convert to DataFrame and Excel
-    df = pd.DataFrame(employees)
-    excel_buffer = io.BytesIO()
-    
-    # Write to Excel with openpyxl engine
-    df.to_excel(excel_buffer, sheet_name='Employees', index=False, engine='openpyxl')
-    
-    excel_buffer.seek(0)
+    # Write the rows straight into a write-only workbook
+    excel_buffer = io.BytesIO(export_records_to_excel(employees, 'Employees'))
     
     # Return as streaming response
     return StreamingResponse(
@@ -1378,6 +1320,84 @@ def export_excel(
         headers={"Content-Disposition": "attachment; filename=employees.xlsx"}
     )
 
+def _clean_import_value(field: str, value):
+    """Normalize one imported Excel cell of the given employee field"""
+    # Handle NaN values
+    if pd.isna(value):
+        value = ""
+    # Handle datetime values
+    elif hasattr(value, 'strftime'):
+        value = value.strftime('%Y-%m-%d')
+    # Handle numeric values
+    elif isinstance(value, (int, float)):
+        # Keep salary as integer
+        if field == 'salary':
+            value = int(value)
+        # Convert numeric fields to string without decimals if they're whole numbers
+        elif field in ['id', 'tax_code', 'social_insurance_number', 'bank_account', 'Id_number', 'phone']:
+            # Remove .0 from floats that are actually integers
+            if isinstance(value, float) and value.is_integer():
+                value = str(int(value))
+            else:
+                value = str(value)
+        else:
+            value = str(value)
+    else:
+        value = str(value).strip()
+    
+    # Remove .0 from string values that end with it (for emergency contact, dependent count, etc.)
+    if isinstance(value, str) and value.endswith('.0'):
+        value = value[:-2]
+    
+    # Add leading zeros for phone numbers (Vietnamese phone numbers should be 10 digits)
+    if field in ['phone', 'emergency_contact'] and value and value != "":
+        value_str = str(value)
+        # Remove any decimal points
+        if '.' in value_str:
+            value_str = value_str.split('.')[0]
+        # Add leading zero if it's a 9-digit phone number
+        if len(value_str) == 9:
+            value_str = '0' + value_str
+        value = value_str
+    
+    # Add leading zeros for ID numbers if needed (Vietnamese CMND/CCCD are typically 9 or 12 digits)
+    if field == 'Id_number' and value and value != "":
+        value_str = str(value)
+        # Remove any decimal points
+        if '.' in value_str:
+            value_str = value_str.split('.')[0]
+        # Add leading zero if it's an 11-digit ID that should be 12
+        if len(value_str) == 11:
+            value_str = '0' + value_str
+        value = value_str
+    
+    # Special handling for PVI Care - more robust
+    if field == 'pvi_care':
+        if value and str(value).lower() in ['x', 'có', 'co', 'yes', '1', 'true']:
+            value = "Có"
+        elif not value or str(value).lower() in ['', 'không', 'khong', 'no', '0', 'false']:
+            value = "Không"
+        else:
+            value = ""
+    
+    return value
+
+def _clean_import_column(field: str, values) -> list:
+    """
+    _clean_import_value over a column's cells. Columns repeat the same values
+    (departments, dates, PVI Care marks), so each distinct value is cleaned
+    once; the key includes the type because e.g. True == 1 cleans differently.
+    """
+    cleaned = {}
+    result = []
+    for value in values:
+        key = (type(value), value)
+        try:
+            result.append(cleaned[key])
+        except KeyError:
+            result.append(cleaned.setdefault(key, _clean_import_value(field, value)))
+    return result
+
 @router.post("/import/excel")
 async def import_excel(
     file: UploadFile = File(...),
@@ -1446,74 +1466,14 @@ async def import_excel(
         # Rename columns to English
         df = df.rename(columns=field_mapping)
         
-        # Process each row
-        new_employees = []
-        for _, row in df.iterrows():
-            employee = {}
-            for field in field_mapping.values():
-                value = row.get(field)
-                
-                # Handle NaN values
-                if pd.isna(value):
-                    value = ""
-                # Handle datetime values
-                elif hasattr(value, 'strftime'):
-                    value = value.strftime('%Y-%m-%d')
-                # Handle numeric values
-                elif isinstance(value, (int, float)):
-                    # Keep salary as integer
-                    if field == 'salary':
-                        value = int(value)
-                    # Convert numeric fields to string without decimals if they're whole numbers
-                    elif field in ['id', 'tax_code', 'social_insurance_number', 'bank_account', 'Id_number', 'phone']:
-                        # Remove .0 from floats that are actually integers
-                        if isinstance(value, float) and value.is_integer():
-                            value = str(int(value))
-                        else:
-                            value = str(value)
-                    else:
-                        value = str(value)
-                else:
-                    value = str(value).strip()
-                
-                # Remove .0 from string values that end with it (for emergency contact, dependent count, etc.)
-                if isinstance(value, str) and value.endswith('.0'):
-                    value = value[:-2]
-                
-                # Add leading zeros for phone numbers (Vietnamese phone numbers should be 10 digits)
-                if field in ['phone', 'emergency_contact'] and value and value != "":
-                    value_str = str(value)
-                    # Remove any decimal points
-                    if '.' in value_str:
-                        value_str = value_str.split('.')[0]
-                    # Add leading zero if it's a 9-digit phone number
-                    if len(value_str) == 9:
-                        value_str = '0' + value_str
-                    value = value_str
-                
-                # Add leading zeros for ID numbers if needed (Vietnamese CMND/CCCD are typically 9 or 12 digits)
-                if field == 'Id_number' and value and value != "":
-                    value_str = str(value)
-                    # Remove any decimal points
-                    if '.' in value_str:
-                        value_str = value_str.split('.')[0]
-                    # Add leading zero if it's an 11-digit ID that should be 12
-                    if len(value_str) == 11:
-                        value_str = '0' + value_str
-                    value = value_str
-                
-                # Special handling for PVI Care - more robust
-                if field == 'pvi_care':
-                    if value and str(value).lower() in ['x', 'có', 'co', 'yes', '1', 'true']:
-                        value = "Có"
-                    elif not value or str(value).lower() in ['', 'không', 'khong', 'no', '0', 'false']:
-                        value = "Không"
-                    else:
-                        value = ""
-                
-                employee[field] = value
-            
-            new_employees.append(employee)
+        # Clean one column at a time; a column missing from the sheet is
+        # cleaned as if every cell were empty
+        fields = list(field_mapping.values())
+        columns = [
+            _clean_import_column(field, df[field].astype(object) if field in df.columns else [None] * len(df))
+            for field in fields
+        ]
+        new_employees = [dict(zip(fields, values)) for values in zip(*columns)]
 
         # Save to user-specific encrypted file
         success = employee_service.save_employees(x_username, x_password, new_employees)
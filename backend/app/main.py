@@ -3,23 +3,34 @@ Main FastAPI application module.
 Handles server initialization, middleware, routing, and configuration.
 """
 import os
+import sys
 import time
-import json
+import queue
+import hashlib
 import asyncio
+import logging
+import logging.handlers
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import orjson
 
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import GZipResponder
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from .api.routes import router
+from .api.responses import OrjsonResponse
 
 
 # ============ Configuration ============
@@ -38,7 +49,95 @@ def is_production() -> bool:
     return get_environment() == "production"
 
 
+# Opt-in response body logging (LOG_BODY=1); off by default so API responses
+# pass through the logging middleware untouched
+LOG_BODY = os.getenv("LOG_BODY") == "1"
+LOG_BODY_CAP = 4096  # bytes of a response body buffered for the log line
+
+# Frontend origins allowed to call the API cross-origin (comma-separated
+# CORS_ORIGINS). The SPA itself is same-origin: served by this app in
+# production and proxied alongside the API in development.
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
+
+# Built frontend files served in production
+STATIC_DIR = Path("dist/public")
+
+# Responses smaller than this (bytes) aren't worth gzipping
+GZIP_MINIMUM_SIZE = 1024
+# Downloads that are already deflated (ZIP archives, .xlsx workbooks); gzip
+# would only cost CPU, so they are sent as they are
+PRECOMPRESSED_CONTENT_TYPES = ("application/zip", "application/vnd.openxmlformats-")
+
+# index.html is immutable per deploy; it is read once at startup (see lifespan)
+INDEX_HTML_BYTES: Optional[bytes] = None
+INDEX_ETAG: Optional[str] = None
+
+
+def load_index_html() -> None:
+    """Cache the SPA index.html bytes and their ETag in memory."""
+    global INDEX_HTML_BYTES, INDEX_ETAG
+    index_file = STATIC_DIR / "index.html"
+    if not index_file.is_file():
+        INDEX_HTML_BYTES = None
+        INDEX_ETAG = None
+        return
+    INDEX_HTML_BYTES = index_file.read_bytes()
+    INDEX_ETAG = f'"{hashlib.blake2b(INDEX_HTML_BYTES, digest_size=16).hexdigest()}"'
+
+
+# ============ Logging Configuration ============
+class TruncateFilter(logging.Filter):
+    """
+    Truncate long access log messages (e.g. ones carrying a response body).
+    Runs on the listener thread, so requests never pay for it.
+    """
+
+    def __init__(self, max_length: int = 80):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = message[:self.max_length - 1] + "…"
+            record.args = None
+        return True
+
+
+# Matches the Express format: "10:42:01 AM [fastapi] GET /api/... 200 in 3ms"
+access_handler = logging.StreamHandler(sys.stdout)
+access_handler.setFormatter(logging.Formatter("%(asctime)s [fastapi] %(message)s", datefmt="%I:%M:%S %p"))
+access_handler.addFilter(TruncateFilter())
+
+# Access logs go through a queue so the request path never blocks on stdout;
+# the listener thread does the actual writing (started/stopped in lifespan).
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, access_handler)
+
+logger = logging.getLogger("fastapi.access")
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+
 # ============ Logging Middleware ============
+def _rebuild_response(response: Response, head: bytes, rest) -> Response:
+    """
+    Re-emit a response whose first bytes were already drained for logging:
+    the buffered head is replayed, then the rest of the original body
+    iterator streams through. The original raw header list is reused rather
+    than copied into a dict.
+    """
+    async def replay():
+        yield head
+        async for chunk in rest:
+            yield chunk
+    
+    rebuilt = StreamingResponse(replay(), status_code=response.status_code)
+    rebuilt.raw_headers = response.raw_headers
+    return rebuilt
+
+
 class LoggingMiddleware(BaseHTTPMiddleware):
     """
     Middleware for logging requests and responses.
@@ -62,54 +161,63 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         # Calculate duration
         duration = int((time.time() - start_time) * 1000)  # Convert to milliseconds
         
-        # Log API requests only
-        if request.url.path.startswith("/api"):
-            # Try to capture response body for logging (only for JSON responses)
-            if hasattr(response, "body"):
+        # Log API requests only (and only when the access logger is enabled)
+        if request.url.path.startswith("/api") and logger.isEnabledFor(logging.INFO):
+            # Capture the response body only when body logging is enabled and
+            # the response is uncompressed JSON; otherwise the response passes
+            # through as-is
+            if (LOG_BODY and response.headers.get("content-type", "").startswith("application/json")
+                    and "content-encoding" not in response.headers):
                 try:
-                    # For streaming responses, we need to collect the body
-                    if hasattr(response, "body_iterator"):
-                        body_chunks = []
-                        async for chunk in response.body_iterator:
-                            body_chunks.append(chunk)
-                        response_body = b"".join(body_chunks)
-                        # Create new response with the collected body
-                        response = Response(
-                            content=response_body,
-                            status_code=response.status_code,
-                            headers=dict(response.headers),
-                            media_type=response.media_type
-                        )
-                        
-                        # Try to parse as JSON for logging
-                        if response.media_type == "application/json":
-                            try:
-                                response_json = json.loads(response_body)
-                                response_body = json.dumps(response_json)
-                            except:
-                                response_body = None
+                    # Buffer at most LOG_BODY_CAP bytes; anything past that is
+                    # streamed straight through by _rebuild_response
+                    buf = bytearray()
+                    body_iterator = response.body_iterator
+                    async for chunk in body_iterator:
+                        buf.extend(chunk)
+                        if len(buf) >= LOG_BODY_CAP:
+                            break
+                    response = _rebuild_response(response, bytes(buf), body_iterator)
+                    response_body = buf[:LOG_BODY_CAP].decode("utf-8", errors="replace")
                 except Exception:
                     response_body = None
             
-            # Format log message
-            log_message = f"{request.method} {request.url.path} {response.status_code} in {duration}ms"
-            
-            # Add response body if available
+            # Lazy %-formatting; timestamp and truncation are handled by the
+            # handler's formatter and TruncateFilter
             if response_body:
-                log_message += f" :: {response_body}"
-                # Truncate if too long
-                if len(log_message) > 80:
-                    log_message = log_message[:79] + "…"
-            
-            # Log to console (matching Express format with timestamp)
-            import datetime
-            timestamp = datetime.datetime.now().strftime("%I:%M:%S %p")
-            print(f"{timestamp} [fastapi] {log_message}")
+                logger.info(
+                    "%s %s %d in %dms :: %s",
+                    request.method, request.url.path, response.status_code, duration, response_body,
+                )
+            else:
+                logger.info(
+                    "%s %s %d in %dms",
+                    request.method, request.url.path, response.status_code, duration,
+                )
         
         return response
 
 
 # ============ Error Handlers ============
+# Serialized bodies for fixed error payloads, so repeated errors (401s during
+# a brute-force, 404s from scanners) don't re-serialize the same JSON
+_GENERIC_500_BODY = orjson.dumps({
+    "message": "Internal Server Error",
+    "errors": ["An unexpected error occurred"]
+})
+
+
+@lru_cache(maxsize=256)
+def _static_error_body(message: str) -> bytes:
+    """Serialized {"message": message, "errors": []} body, memoized per message."""
+    return orjson.dumps({"message": message, "errors": []})
+
+
+def _json_error_response(body: bytes, status_code: int) -> Response:
+    """Wrap a pre-serialized JSON error body."""
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """
     Handle validation errors with consistent format.
@@ -145,6 +253,9 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
         message = str(exc.detail)
         errors = []
     
+    if not errors:
+        return _json_error_response(_static_error_body(message), exc.status_code)
+    
     return JSONResponse(
         status_code=exc.status_code,
         content={
@@ -162,11 +273,14 @@ async def general_exception_handler(request: Request, exc: Exception):
     # Log the error for debugging
     print(f"Unhandled exception: {exc}")
     
+    if not is_development():
+        return _json_error_response(_GENERIC_500_BODY, 500)
+    
     return JSONResponse(
         status_code=500,
         content={
             "message": "Internal Server Error",
-            "errors": [str(exc)] if is_development() else ["An unexpected error occurred"]
+            "errors": [str(exc)]
         }
     )
 
@@ -182,10 +296,14 @@ async def lifespan(app: FastAPI):
     env = get_environment()
     port = int(os.getenv("PORT", "8000"))
     print(f"Starting FastAPI server in {env} mode on port {port}")
+    log_listener.start()
+    if is_production():
+        load_index_html()
     
     yield
     
     # Shutdown
+    log_listener.stop()
     print("Shutting down FastAPI server")
 
 
@@ -196,6 +314,8 @@ app = FastAPI(
     description="Vietnamese salary calculation API with tax computation",
     version="1.0.0",
     lifespan=lifespan,
+    # Render route responses with orjson instead of the stdlib json encoder
+    default_response_class=OrjsonResponse,
     # Disable automatic docs in production
     docs_url="/docs" if is_development() else None,
     redoc_url="/redoc" if is_development() else None,
@@ -204,33 +324,89 @@ app = FastAPI(
 
 
 # ============ Middleware Configuration ============
+class FastCORSMiddleware(CORSMiddleware):
+    """
+    CORSMiddleware with the allowed origins and methods frozen into sets,
+    so the per-request origin/method checks are O(1) lookups instead of
+    list scans. The "*" wildcard is still short-circuited by Starlette.
+    """
+    
+    def __init__(self, app: ASGIApp, **kwargs: Any):
+        super().__init__(app, **kwargs)
+        self.allow_origins = frozenset(self.allow_origins)
+        self.allow_methods = frozenset(self.allow_methods)
 
-# Add CORS middleware
-if is_development():
-    # Development CORS settings - allow all origins in development
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allow all origins in development
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-else:
-    # Production CORS settings - more restrictive
-    # TODO: Replace with your actual production domain(s)
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=[
-            "https://your-domain.com",
-            "https://www.your-domain.com"
-        ],  # Configure based on your production domain
-        allow_credentials=True,
-        allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
-        allow_headers=["*"],
-    )
 
-# Add logging middleware
-app.add_middleware(LoggingMiddleware)
+class DownloadGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that passes responses with a PRECOMPRESSED_CONTENT_TYPES
+    Content-Type through untouched. The GZipMiddleware of the locked Starlette
+    release has no exclude_content_types option, so the response is routed
+    past the gzip responder once its headers are known.
+    """
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("Accept-Encoding", ""):
+            await super().__call__(scope, receive, send)
+            return
+        
+        passthrough = False
+        
+        async def route_downloads(scope: Scope, receive: Receive, gzip_send: Send) -> None:
+            async def route(message: Message) -> None:
+                nonlocal passthrough
+                if message["type"] == "http.response.start":
+                    content_type = Headers(raw=message["headers"]).get("content-type", "")
+                    passthrough = content_type.startswith(PRECOMPRESSED_CONTENT_TYPES)
+                await (send if passthrough else gzip_send)(message)
+            
+            await self.app(scope, receive, route)
+        
+        await GZipResponder(route_downloads, self.minimum_size, compresslevel=self.compresslevel)(scope, receive, send)
+
+
+def configure_middleware(app: FastAPI) -> None:
+    """
+    Register CORS and logging middleware for the current environment.
+    The environment is checked once here instead of per middleware.
+    """
+    if is_development():
+        # Development CORS settings - any origin unless CORS_ORIGINS narrows it
+        cors_options = dict(
+            allow_origins=CORS_ORIGINS or ["*"],
+            allow_methods=["*"],
+        )
+    elif CORS_ORIGINS:
+        # Production CORS settings - only the configured origins
+        cors_options = dict(
+            allow_origins=CORS_ORIGINS,
+            allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
+        )
+    else:
+        # The SPA is served from this app, so no cross-origin access is needed
+        cors_options = None
+    
+    # Compress text responses (JSON, CSV, the SPA's JS/CSS bundles); ZIP and
+    # .xlsx downloads are already deflated, so they're sent as they are.
+    # Innermost, so it still sees each response's Content-Length and leaves
+    # small bodies alone.
+    app.add_middleware(DownloadGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=6)
+    
+    if cors_options is not None:
+        app.add_middleware(
+            FastCORSMiddleware,
+            # Credentials can't be combined with a "*" origin (the spec
+            # forbids it), so they're only allowed for explicit origins
+            allow_credentials="*" not in cors_options["allow_origins"],
+            allow_headers=["*"],
+            **cors_options,
+        )
+    
+    # Add logging middleware
+    app.add_middleware(LoggingMiddleware)
+
+
+configure_middleware(app)
 
 
 # ============ Exception Handlers ============
@@ -263,8 +439,7 @@ app.include_router(router)
 # In development, Vite serves the frontend
 # In production, FastAPI serves the built files
 if is_production():
-    # Path to the built frontend files
-    static_dir = Path("dist/public")
+    static_dir = STATIC_DIR
     
     # Check if static directory exists
     if static_dir.exists() and static_dir.is_dir():
@@ -273,7 +448,7 @@ if is_production():
         
         # Serve index.html for all non-API routes (SPA support)
         @app.get("/{full_path:path}")
-        async def serve_spa(full_path: str):
+        async def serve_spa(full_path: str, request: Request):
             """
             Serve the SPA index.html for all non-API routes.
             This enables client-side routing.
@@ -282,12 +457,18 @@ if is_production():
             if full_path.startswith("api/"):
                 raise HTTPException(status_code=404, detail="API endpoint not found")
             
-            # Serve index.html
-            index_file = static_dir / "index.html"
-            if index_file.exists():
-                return FileResponse(index_file)
-            else:
+            # Serve the cached index.html (loaded once at startup)
+            if INDEX_HTML_BYTES is None:
                 raise HTTPException(status_code=404, detail="Application not found")
+            
+            if request.headers.get("if-none-match") == INDEX_ETAG:
+                return Response(status_code=304, headers={"ETag": INDEX_ETAG})
+            
+            return Response(
+                content=INDEX_HTML_BYTES,
+                media_type="text/html",
+                headers={"ETag": INDEX_ETAG, "Cache-Control": "no-cache"}
+            )
     else:
         print(f"Warning: Static directory {static_dir} not found. Static file serving disabled.")
 else:
@@ -359,7 +540,9 @@ if __name__ == "__main__":
         print(f"API Documentation: http://localhost:{port}/docs")
         print(f"Alternative docs: http://localhost:{port}/redoc")
     
-    # Run the server
+    # Run the server. The default "auto" loop and http settings pick uvloop
+    # and httptools when they're installed; a single process is kept because
+    # the employee and calculation storage lives in memory.
     uvicorn.run(
         "backend.app.main:app",  # Module path to the app
         host=host,
@@ -370,6 +553,7 @@ if __name__ == "__main__":
         reload_dirs=["backend"] if reload else None,
         # Use colors in terminal output
         use_colors=True,
-        # Access log format similar to Express
-        access_log=True,
+        # LoggingMiddleware already logs API requests; uvicorn's own
+        # per-request access log is only kept in development
+        access_log=is_development(),
     )
\ No newline at end of file
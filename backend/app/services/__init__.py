@@ -1,7 +1,7 @@
 """
 Services module for backend business logic.
 """
-from .calculator import calculate_salary, TAX_BRACKETS
+from .calculator import calculate_salary, TAX_LIMITS, TAX_RATES, TAX_DEDUCTIONS
 from .employee_service import employee_service
 
-__all__ = ["calculate_salary", "TAX_BRACKETS", "employee_service"]
\ No newline at end of file
+__all__ = ["calculate_salary", "TAX_LIMITS", "TAX_RATES", "TAX_DEDUCTIONS", "employee_service"]
\ No newline at end of file
@@ -3,142 +3,318 @@ Batch pay slip generator service.
 Generates multiple pay slip Excel files for all employees.
 """
 import io
+import os
+import re
 import zipfile
-from typing import List, Dict, Any
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
 from ..models.schemas import SelectEmployee
+from .calculator import TAX_LIMITS, TAX_RATES, TAX_DEDUCTIONS
 from .payslip_excel_generator import generate_payslip_excel
 
 
-def calculate_employee_salary_data(employee: SelectEmployee) -> Dict[str, Any]:
+# Input fields read from each employee, in array order
+_INPUT_FIELDS = (
+    "salary", "bonus", "allowanceTax", "ot15", "ot20", "ot30",
+    "dependants", "advance", "actualDaysWorked", "totalWorkdays",
+)
+
+# Tax brackets as arrays for np.searchsorted
+_TAX_LIMITS = np.array(TAX_LIMITS, dtype=np.float64)
+_TAX_RATES = np.array(TAX_RATES, dtype=np.float64)
+_TAX_DEDUCTIONS = np.array(TAX_DEDUCTIONS, dtype=np.float64)
+
+
+class SalaryRow(NamedTuple):
+    """Calculated salary values for one employee, as consumed by generate_payslip_excel"""
+    employeeNo: str
+    name: str
+    salary: float
+    bonus: float
+    allowanceTax: float
+    ot15: float
+    ot20: float
+    ot30: float
+    dependants: float
+    advance: float
+    actualDaysWorked: float
+    totalWorkdays: float
+    augSalary: int
+    overtimePayPIT: int
+    totalSalary: int
+    dependentRelief: float
+    assessableIncome: float
+    personalIncomeTax: int
+    employeeInsurance: float
+    unionFee: float
+    overtimePayNonPIT: int
+    totalOTHours: int
+    totalNetIncome: int
+    personalRelief: int
+
+
+def calculate_batch_salary_data(employees: List[SelectEmployee]) -> List[Optional[SalaryRow]]:
     """
-    Calculate complete salary data for an employee (mimics frontend calculation logic).
+    Calculate complete salary data for a list of employees (mimics frontend calculation logic).
+    
+    All employees are computed at once with NumPy array operations; per-employee
+    rows are only materialized at the end. np.rint rounds half to even, the same
+    as Python's round(), so results match the former per-employee calculation.
     
     Args:
-        employee: Employee data from database
+        employees: Employee data from database
         
     Returns:
-        Dictionary with all calculated salary values
-    """
-    # Extract employee values
-    employee_no = employee.employeeNo
-    name = employee.name
-    salary = employee.salary
-    bonus = employee.bonus
-    allowance_tax = employee.allowanceTax
-    ot15 = employee.ot15
-    ot20 = employee.ot20
-    ot30 = employee.ot30
-    dependants = employee.dependants
-    advance = employee.advance
-    actual_days_worked = getattr(employee, 'actualDaysWorked', 20)  # Default to 20 if not provided
-    total_workdays = getattr(employee, 'totalWorkdays', 20)  # Default to 20 if not provided
+        List of SalaryRow tuples with all calculated salary values, in input order;
+        None for employees whose values cannot be computed (zero total workdays)
+    """
+    if not employees:
+        return []
+    
+    # One pass over the list builds a (fields x employees) float matrix
+    values = np.array(
+        [[getattr(emp, field) for field in _INPUT_FIELDS] for emp in employees],
+        dtype=np.float64,
+    ).T
+    (salary, bonus, allowance_tax, ot15, ot20, ot30,
+     dependants, advance, actual_days_worked, total_workdays) = values
+    
+    # Rows with zero total workdays are left out (the scalar version raised
+    # ZeroDivisionError for them); silence the resulting inf/nan warnings
+    computable = total_workdays != 0
     
     # Calculate derived values using dynamic workdays
-    aug_salary = round((salary / total_workdays) * actual_days_worked)
-    overtime_pay_pit = int((aug_salary / 22 / 8) * (ot15 + ot20 + ot30))  # Math.floor equivalent
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aug_salary = np.rint(np.where(computable, (salary / total_workdays) * actual_days_worked, 0))
+    ot_rate = aug_salary / 176  # Hourly overtime base (22 days x 8 hours)
+    overtime_pay_pit = np.trunc(ot_rate * (ot15 + ot20 + ot30))  # Math.floor equivalent
     personal_relief = 11000000  # Default value
     dependent_relief = 4400000 * dependants
     employee_insurance = salary * 0.105
-    union_fee = min(salary * 0.005, 234000)
+    union_fee = np.minimum(salary * 0.005, 234000)
     heso_coeff = ot15 * 0.5 + ot20 + ot30 * 2
-    overtime_pay_non_pit = round((aug_salary / 22 / 8) * heso_coeff)
+    overtime_pay_non_pit = np.rint(ot_rate * heso_coeff)
     
     # A. Salary and Allowance = Day-work salary + Over Time + Allowance must pay PIT + Bonus
     total_overtime_pay = overtime_pay_pit + overtime_pay_non_pit
-    total_salary = round(aug_salary + total_overtime_pay + allowance_tax + bonus)
-    assessable_income = max(0, total_salary - (employee_insurance + personal_relief + dependent_relief))
-    
-    # Calculate progressive tax
-    TAX_BRACKETS = [
-        {"limit": 5000000, "rate": 0.05, "deduction": 0},
-        {"limit": 10000000, "rate": 0.10, "deduction": 250000},
-        {"limit": 18000000, "rate": 0.15, "deduction": 750000},
-        {"limit": 32000000, "rate": 0.20, "deduction": 1650000},
-        {"limit": 52000000, "rate": 0.25, "deduction": 3250000},
-        {"limit": 80000000, "rate": 0.30, "deduction": 5850000},
-        {"limit": float('inf'), "rate": 0.35, "deduction": 9850000},
-    ]
+    total_salary = np.rint(aug_salary + total_overtime_pay + allowance_tax + bonus)
+    assessable_income = np.maximum(0, total_salary - (employee_insurance + personal_relief + dependent_relief))
     
-    pit = 0
-    for bracket in TAX_BRACKETS:
-        if assessable_income <= bracket["limit"]:
-            pit = assessable_income * bracket["rate"] - bracket["deduction"]
-            break
-    personal_income_tax = round(max(pit, 0))
+    # Calculate progressive tax (first bracket whose limit >= assessable income)
+    bracket = np.searchsorted(_TAX_LIMITS, assessable_income, side="left")
+    pit = assessable_income * _TAX_RATES[bracket] - _TAX_DEDUCTIONS[bracket]
+    personal_income_tax = np.rint(np.maximum(pit, 0))
     
     # Total OT hours calculation (matching frontend)
-    total_ot_hours = round(ot15 + ot20 + ot30 + ot15 * 0.5 + ot20 + ot30 * 2)
-    total_net_income = round(total_salary - personal_income_tax - employee_insurance - union_fee + overtime_pay_non_pit - advance)
-    
-    return {
-        "employeeNo": employee_no,
-        "name": name,
-        "salary": salary,
-        "bonus": bonus,
-        "allowanceTax": allowance_tax,
-        "ot15": ot15,
-        "ot20": ot20,
-        "ot30": ot30,
-        "dependants": dependants,
-        "advance": advance,
-        "actualDaysWorked": actual_days_worked,
-        "totalWorkdays": total_workdays,
-        "augSalary": aug_salary,
-        "overtimePayPIT": overtime_pay_pit,
-        "totalSalary": total_salary,
-        "personalRelief": personal_relief,
-        "dependentRelief": dependent_relief,
-        "assessableIncome": assessable_income,
-        "personalIncomeTax": personal_income_tax,
-        "employeeInsurance": employee_insurance,
-        "unionFee": union_fee,
-        "overtimePayNonPIT": overtime_pay_non_pit,
-        "totalOTHours": total_ot_hours,
-        "totalNetIncome": total_net_income,
-    }
-
-
-def generate_batch_payslip_zip(employees: List[SelectEmployee]) -> bytes:
-    """
-    Generate a ZIP file containing Excel pay slips for all employees.
+    total_ot_hours = np.rint(ot15 + ot20 + ot30 + ot15 * 0.5 + ot20 + ot30 * 2)
+    total_net_income = np.rint(
+        total_salary - personal_income_tax - employee_insurance - union_fee + overtime_pay_non_pit - advance
+    )
+    
+    # Materialize rows in SalaryRow field order; rounded columns become Python ints
+    columns = (
+        salary.tolist(),
+        bonus.tolist(),
+        allowance_tax.tolist(),
+        ot15.tolist(),
+        ot20.tolist(),
+        ot30.tolist(),
+        dependants.tolist(),
+        advance.tolist(),
+        actual_days_worked.tolist(),
+        total_workdays.tolist(),
+        aug_salary.astype(np.int64).tolist(),
+        overtime_pay_pit.astype(np.int64).tolist(),
+        total_salary.astype(np.int64).tolist(),
+        dependent_relief.tolist(),
+        assessable_income.tolist(),
+        personal_income_tax.astype(np.int64).tolist(),
+        employee_insurance.tolist(),
+        union_fee.tolist(),
+        overtime_pay_non_pit.astype(np.int64).tolist(),
+        total_ot_hours.astype(np.int64).tolist(),
+        total_net_income.astype(np.int64).tolist(),
+    )
+    
+    return [
+        SalaryRow(emp.employeeNo, emp.name, *values, personal_relief) if ok else None
+        for emp, ok, *values in zip(employees, computable.tolist(), *columns)
+    ]
+
+
+def calculate_employee_salary_data(employee: SelectEmployee) -> SalaryRow:
+    """
+    Calculate complete salary data for a single employee.
+    
+    Args:
+        employee: Employee data from database
+        
+    Returns:
+        SalaryRow with all calculated salary values
+    """
+    result = calculate_batch_salary_data([employee])[0]
+    if result is None:
+        raise ZeroDivisionError("totalWorkdays must not be zero")
+    return result
+
+
+# Filename sanitizing: NFKD splits Vietnamese letters into ASCII base + combining
+# marks, which the ASCII encode then drops; Đ/đ don't decompose, so map them
+_FILENAME_TRANSLATION = str.maketrans({'Đ': 'D', 'đ': 'd'})
+_RE_FILENAME_STRIP = re.compile(r'[^\w\s-]')
+_RE_FILENAME_SEPARATORS = re.compile(r'[-\s]+')
+
+
+def safe_filename_part(name: str, fallback: str = "") -> str:
+    """
+    Convert a (Vietnamese) name to an ASCII-only filename fragment,
+    e.g. "Đỗ Thị Hà" -> "Do_Thi_Ha". Returns `fallback` when nothing is
+    left after transliteration (e.g. "李小龍").
+    """
+    ascii_name = unicodedata.normalize('NFKD', name).translate(_FILENAME_TRANSLATION)
+    ascii_name = ascii_name.encode('ascii', 'ignore').decode('ascii')
+    safe_name = _RE_FILENAME_STRIP.sub('', ascii_name).strip()
+    return _RE_FILENAME_SEPARATORS.sub('_', safe_name) or fallback
+
+
+def payslip_filename(employee: SelectEmployee) -> str:
+    """
+    Name of an employee's pay slip inside a ZIP. The employee number keeps
+    entries unique when names are shared or transliterate to nothing.
+    """
+    name_part = safe_filename_part(employee.name)
+    if not name_part:
+        return f"Payslip_{employee.employeeNo}.xlsx"
+    return f"Payslip_{name_part}_{employee.employeeNo}.xlsx"
+
+
+def _build_payslip(employee: SelectEmployee, calculation_data: Optional[SalaryRow]) -> Optional[Tuple[str, bytes]]:
+    """
+    Build one employee's pay slip.
+    
+    Returns:
+        (filename, excel bytes), or None if the pay slip could not be generated
+    """
+    try:
+        if calculation_data is None:
+            raise ZeroDivisionError("totalWorkdays must not be zero")
+        
+        # Generate Excel file for this employee
+        excel_bytes = generate_payslip_excel(calculation_data)
+        return payslip_filename(employee), excel_bytes
+    except Exception as e:
+        # Log error but continue with other employees
+        print(f"Failed to generate pay slip for {employee.name} ({employee.employeeNo}): {str(e)}")
+        return None
+
+
+def _iter_payslips(
+    employees: List[SelectEmployee], batch_data: List[Optional[SalaryRow]]
+) -> Iterator[Optional[Tuple[str, bytes]]]:
+    """
+    Build pay slips concurrently on a thread pool and yield them in employee order.
+    
+    Only a small window of pay slips is in flight at a time, so memory stays
+    bounded by the window rather than the whole batch when the consumer is slow.
+    """
+    max_workers = min(len(employees), os.cpu_count() or 1)
+    window = max_workers * 2
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for employee, calculation_data in zip(employees, batch_data):
+            pending.append(executor.submit(_build_payslip, employee, calculation_data))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Drop queued work if the consumer stopped early (e.g. client disconnected)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _write_payslip_entries(zip_file: zipfile.ZipFile, employees: List[SelectEmployee]) -> Iterator[None]:
+    """Add each employee's pay slip to zip_file, yielding after every entry."""
+    # Calculate salary data for all employees at once
+    batch_data = calculate_batch_salary_data(employees)
+    
+    for payslip in _iter_payslips(employees, batch_data):
+        if payslip is None:
+            continue
+        filename, excel_bytes = payslip
+        
+        # Add Excel file to ZIP
+        zip_file.writestr(filename, excel_bytes)
+        yield
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable stream that holds written bytes until drained."""
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def generate_batch_payslip_zip(employees: List[SelectEmployee], out_stream: BinaryIO) -> None:
+    """
+    Write a ZIP file containing Excel pay slips for all employees to out_stream.
+    
+    Pay slips are built concurrently on a thread pool; the ZIP itself is only
+    written from the calling thread, in employee order. Entries are stored
+    uncompressed because .xlsx files are already deflated ZIP containers.
+    out_stream does not need to be seekable.
+    
+    Args:
+        employees: List of employees to generate pay slips for
+        out_stream: Writable binary stream receiving the ZIP file
+    """
+    if not employees:
+        raise ValueError("No employees provided for batch generation")
+    
+    with zipfile.ZipFile(out_stream, 'w', zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+        for _ in _write_payslip_entries(zip_file, employees):
+            pass
+
+
+def iter_batch_payslip_zip(employees: List[SelectEmployee]) -> Iterator[bytes]:
+    """
+    Generate the pay slip ZIP (see generate_batch_payslip_zip) as a stream of chunks.
+    
+    Each chunk is handed out as soon as its pay slip has been added, so at most
+    one pay slip's bytes are buffered instead of the whole archive.
     
     Args:
         employees: List of employees to generate pay slips for
         
     Returns:
-        Bytes content of the ZIP file
+        Iterator over the bytes of the ZIP file
     """
     if not employees:
         raise ValueError("No employees provided for batch generation")
     
-    # Create ZIP buffer
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for employee in employees:
-            try:
-                # Calculate salary data for this employee
-                calculation_data = calculate_employee_salary_data(employee)
-                
-                # Generate Excel file for this employee
-                excel_bytes = generate_payslip_excel(calculation_data)
-                
-                # Create safe filename
-                import unicodedata
-                import re
-                ascii_name = unicodedata.normalize('NFKD', employee.name)
-                ascii_name = ''.join(c for c in ascii_name if not unicodedata.combining(c))
-                safe_name = re.sub(r'[^\w\s-]', '', ascii_name).strip()
-                safe_name = re.sub(r'[-\s]+', '_', safe_name)
-                filename = f"Payslip_{safe_name}_{employee.employeeNo}.xlsx"
-                
-                # Add Excel file to ZIP
-                zip_file.writestr(filename, excel_bytes)
-                
-            except Exception as e:
-                # Log error but continue with other employees
-                print(f"Failed to generate pay slip for {employee.name} ({employee.employeeNo}): {str(e)}")
-                continue
-    
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    def chunks() -> Iterator[bytes]:
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+            for _ in _write_payslip_entries(zip_file, employees):
+                yield sink.drain()
+        # Central directory
+        yield sink.drain()
+    
+    return chunks()
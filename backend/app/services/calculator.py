@@ -2,21 +2,22 @@
 Salary calculation service that matches the JavaScript implementation.
 Uses custom rounding to match JavaScript Math.round() behavior.
 """
+from bisect import bisect_left
+from math import copysign, floor
 from typing import Union
 from datetime import datetime
 from ..models.schemas import SalaryInput, SalaryResult
 
 
-# Vietnamese tax brackets for 2024
-TAX_BRACKETS = [
-    {"limit": 5_000_000, "rate": 0.05, "deduction": 0},
-    {"limit": 10_000_000, "rate": 0.10, "deduction": 250_000},
-    {"limit": 18_000_000, "rate": 0.15, "deduction": 750_000},
-    {"limit": 32_000_000, "rate": 0.20, "deduction": 1_650_000},
-    {"limit": 52_000_000, "rate": 0.25, "deduction": 3_250_000},
-    {"limit": 80_000_000, "rate": 0.30, "deduction": 5_850_000},
-    {"limit": float('inf'), "rate": 0.35, "deduction": 9_850_000},
-]
+# Vietnamese tax brackets for 2024, as parallel sequences: an assessable
+# income up to TAX_LIMITS[i] is taxed at TAX_RATES[i] minus TAX_DEDUCTIONS[i]
+TAX_LIMITS = (5_000_000, 10_000_000, 18_000_000, 32_000_000, 52_000_000, 80_000_000, float('inf'))
+TAX_RATES = (0.05, 0.10, 0.15, 0.20, 0.25, 0.30, 0.35)
+TAX_DEDUCTIONS = (0, 250_000, 750_000, 1_650_000, 3_250_000, 5_850_000, 9_850_000)
+
+# Relief constants
+PERSONAL_RELIEF = 11_000_000
+DEPENDENT_RELIEF_RATE = 4_400_000
 
 
 def js_round(x: Union[int, float]) -> int:
@@ -24,11 +25,9 @@ def js_round(x: Union[int, float]) -> int:
     Replicate JavaScript's Math.round() behavior.
     JavaScript rounds 0.5 up to the nearest integer.
     """
-    if x >= 0:
-        return int(x + 0.5)
-    else:
-        # For negative numbers, JavaScript rounds -2.5 to -2
-        return int(x - 0.5) if x != int(x) else int(x)
+    # Half-up on the magnitude, sign restored afterwards (negative halves
+    # round away from zero, as the original branchy version did)
+    return int(copysign(floor(abs(x) + 0.5), x))
 
 
 def js_floor(x: Union[int, float]) -> int:
@@ -36,7 +35,63 @@ def js_floor(x: Union[int, float]) -> int:
     Replicate JavaScript's Math.floor() behavior.
     Returns the largest integer less than or equal to x.
     """
-    return int(x) if x >= 0 or x == int(x) else int(x) - 1
+    return floor(x)
+
+
+def _compute_salary_core(
+    salary: float,
+    bonus: float,
+    allowance_tax: float,
+    ot15: float,
+    ot20: float,
+    ot30: float,
+    dependants: float,
+    advance: float,
+    actual_days_worked: float,
+    total_workdays: float,
+) -> tuple:
+    """
+    Pure numeric salary calculation on plain floats (no Pydantic access).
+    
+    Returns:
+        Tuple of (aug_salary, overtime_pay_pit, total_salary, dependent_relief,
+        company_insurance, employee_insurance, union_fee, he_so,
+        overtime_pay_non_pit, assessable_income, personal_income_tax,
+        total_net_income, total_ot_hours); aug_salary is unrounded
+    """
+    # Calculations using dynamic workdays
+    aug_salary = (salary / total_workdays) * actual_days_worked
+    ot_rate = aug_salary / 176  # Hourly overtime base (22 days x 8 hours)
+    overtime_pay_pit = js_floor(ot_rate * (ot15 + ot20 + ot30))
+    total_salary = js_round(aug_salary + bonus + allowance_tax + overtime_pay_pit)
+    dependent_relief = DEPENDENT_RELIEF_RATE * dependants
+    company_insurance = salary * 0.215  # Company pays 21.5%
+    employee_insurance = salary * 0.105
+    union_fee = min(salary * 0.005, 234_000)
+    he_so = ot15 * 0.5 + ot20 + ot30 * 2  # He so coefficient
+    overtime_pay_non_pit = js_round(ot_rate * he_so)
+    assessable_income = max(0, total_salary - (employee_insurance + PERSONAL_RELIEF + dependent_relief))
+    
+    # Calculate progressive tax (first bracket whose limit >= assessable income)
+    bracket = bisect_left(TAX_LIMITS, assessable_income)
+    personal_income_tax = assessable_income * TAX_RATES[bracket] - TAX_DEDUCTIONS[bracket]
+    personal_income_tax = js_round(max(personal_income_tax, 0))
+    
+    total_net_income = js_round(
+        total_salary - personal_income_tax - employee_insurance - union_fee + overtime_pay_non_pit - advance
+    )
+    
+    # Correct formula: ot15 + ot20 + ot30 + ot15*0.5 + ot20 + ot30*2
+    # Which equals: ot15*1.5 + ot20*2 + ot30*3
+    # Or using he_so: ot15 + ot20 + ot30 + he_so
+    total_ot_hours = ot15 + ot20 + ot30 + he_so
+    
+    return (
+        aug_salary, overtime_pay_pit, total_salary, dependent_relief,
+        company_insurance, employee_insurance, union_fee, he_so,
+        overtime_pay_non_pit, assessable_income, personal_income_tax,
+        total_net_income, total_ot_hours,
+    )
 
 
 def calculate_salary(input_data: SalaryInput) -> SalaryResult:
@@ -50,8 +105,6 @@ def calculate_salary(input_data: SalaryInput) -> SalaryResult:
         SalaryResult model with calculated salary components
     """
     # Extract input values
-    employee_no = input_data.employeeNo
-    name = input_data.name
     salary = input_data.salary
     bonus = input_data.bonus
     allowance_tax = input_data.allowanceTax
@@ -63,42 +116,17 @@ def calculate_salary(input_data: SalaryInput) -> SalaryResult:
     actual_days_worked = getattr(input_data, 'actualDaysWorked', 20)  # Default to 20 if not provided
     total_workdays = getattr(input_data, 'totalWorkdays', 20)  # Default to 20 if not provided
     
-    # Constants
-    personal_relief = 11_000_000
-    dependent_relief_rate = 4_400_000
-    
-    # Calculations using dynamic workdays
-    aug_salary = (salary / total_workdays) * actual_days_worked
-    overtime_pay_pit = js_floor((aug_salary / 22 / 8) * (ot15 + ot20 + ot30))
-    total_salary = js_round(aug_salary + bonus + allowance_tax + overtime_pay_pit)
-    dependent_relief = dependent_relief_rate * dependants
-    company_insurance = salary * 0.215  # Company pays 21.5%
-    employee_insurance = salary * 0.105
-    union_fee = min(salary * 0.005, 234_000)
-    he_so = ot15 * 0.5 + ot20 + ot30 * 2  # He so coefficient
-    overtime_pay_non_pit = js_round((aug_salary / 22 / 8) * he_so)
-    assessable_income = max(0, total_salary - (employee_insurance + personal_relief + dependent_relief))
-    
-    # Calculate progressive tax
-    personal_income_tax = 0
-    for bracket in TAX_BRACKETS:
-        if assessable_income <= bracket["limit"]:
-            personal_income_tax = assessable_income * bracket["rate"] - bracket["deduction"]
-            break
-    personal_income_tax = js_round(max(personal_income_tax, 0))
-    
-    total_net_income = js_round(
-        total_salary - personal_income_tax - employee_insurance - union_fee + overtime_pay_non_pit - advance
+    (aug_salary, overtime_pay_pit, total_salary, dependent_relief,
+     company_insurance, employee_insurance, union_fee, he_so,
+     overtime_pay_non_pit, assessable_income, personal_income_tax,
+     total_net_income, total_ot_hours) = _compute_salary_core(
+        salary, bonus, allowance_tax, ot15, ot20, ot30,
+        dependants, advance, actual_days_worked, total_workdays,
     )
     
-    # Correct formula: ot15 + ot20 + ot30 + ot15*0.5 + ot20 + ot30*2
-    # Which equals: ot15*1.5 + ot20*2 + ot30*3
-    # Or using he_so: ot15 + ot20 + ot30 + he_so
-    total_ot_hours = ot15 + ot20 + ot30 + he_so
-    
     return SalaryResult(
-        employeeNo=employee_no,
-        name=name,
+        employeeNo=input_data.employeeNo,
+        name=input_data.name,
         salary=salary,
         bonus=bonus,
         allowanceTax=allowance_tax,
@@ -112,7 +140,7 @@ def calculate_salary(input_data: SalaryInput) -> SalaryResult:
         augSalary=js_round(aug_salary),
         overtimePayPIT=overtime_pay_pit,
         totalSalary=total_salary,
-        personalRelief=personal_relief,
+        personalRelief=PERSONAL_RELIEF,
         dependentRelief=dependent_relief,
         assessableIncome=assessable_income,
         personalIncomeTax=personal_income_tax,
@@ -124,4 +152,4 @@ def calculate_salary(input_data: SalaryInput) -> SalaryResult:
         totalOTHours=total_ot_hours,
         totalNetIncome=total_net_income,
         calculatedAt=datetime.utcnow().isoformat() + "Z",
-    )
\ No newline at end of file
+    )
@@ -1,68 +1,399 @@
 import os
-import json
-from typing import List, Dict, Any, Optional
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
 from .encryption_service import encryption_service
 
+# Text fields the employee list is filtered on, kept lowercased per column
+FILTER_TEXT_FIELDS = ("department", "position", "contract_type", "gender", "full_name")
+
+# Salary buckets reported by the statistics: (label, lower bound, upper bound)
+SALARY_RANGES = [
+    ("0-10M", None, 10000000),
+    ("10M-20M", 10000000, 20000000),
+    ("20M-30M", 20000000, 30000000),
+    ("30M+", 30000000, None),
+]
+
+
+def _is_present(value: Any) -> bool:
+    """False for missing values (None, NaN), which the statistics skip"""
+    return value is not None and value == value
+
+
+def compute_statistics(employees: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Employee counts per department, position and contract type (most common
+    first), the average salary and the salary range histogram, in one pass.
+    """
+    if not employees:
+        return {
+            "total_employees": 0,
+            "departments": {},
+            "positions": {},
+            "contract_types": {},
+            "average_salary": 0,
+            "salary_ranges": {}
+        }
+    
+    departments, positions, contract_types = Counter(), Counter(), Counter()
+    salary_ranges = {label: 0 for label, _, _ in SALARY_RANGES}
+    salary_total, salary_count = 0, 0
+    
+    for emp in employees:
+        for counts, field in ((departments, "department"), (positions, "position"), (contract_types, "contract_type")):
+            value = emp.get(field)
+            if _is_present(value):
+                counts[value] += 1
+        
+        salary = emp.get("salary")
+        if isinstance(salary, (int, float)) and not isinstance(salary, bool) and _is_present(salary):
+            salary_total += salary
+            salary_count += 1
+            for label, low, high in SALARY_RANGES:
+                if (low is None or salary >= low) and (high is None or salary < high):
+                    salary_ranges[label] += 1
+                    break
+    
+    return {
+        "total_employees": len(employees),
+        "departments": dict(departments.most_common()),
+        "positions": dict(positions.most_common()),
+        "contract_types": dict(contract_types.most_common()),
+        "average_salary": int(salary_total / salary_count) if salary_count else 0,
+        "salary_ranges": salary_ranges
+    }
+
+
+def _lower(value: Any) -> str:
+    return value.lower() if isinstance(value, str) else ""
+
+
+def build_filter_columns(employees: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Column arrays the employee filters run on: each FILTER_TEXT_FIELDS field
+    lowercased, and the date of birth split into year/month/day with a
+    validity mask (employees without a parsable dob never match an age filter).
+    """
+    columns = {
+        field: np.array([_lower(emp.get(field)) for emp in employees], dtype=str)
+        for field in FILTER_TEXT_FIELDS
+    }
+    
+    dob = np.zeros((len(employees), 3), dtype=np.int64)
+    dob_valid = np.zeros(len(employees), dtype=bool)
+    for i, emp in enumerate(employees):
+        dob_str = emp.get("dob")
+        if not dob_str:
+            continue
+        try:
+            parsed = datetime.strptime(dob_str, '%Y-%m-%d')
+        except (ValueError, TypeError):
+            continue
+        dob[i] = parsed.year, parsed.month, parsed.day
+        dob_valid[i] = True
+    columns["dob_year"], columns["dob_month"], columns["dob_day"] = dob.T
+    columns["dob_valid"] = dob_valid
+    return columns
+
+
+def filter_mask(
+    columns: Dict[str, np.ndarray],
+    department: Optional[str] = None,
+    position: Optional[str] = None,
+    contract_type: Optional[str] = None,
+    gender: Optional[str] = None,
+    search: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Boolean mask of the employees matching every given filter: department,
+    contract type and gender match exactly, position and search (employee
+    name only) as substrings, all case-insensitive; ages are whole years today.
+    """
+    mask = np.ones(len(columns["dob_valid"]), dtype=bool)
+    
+    for field, value in (("department", department), ("contract_type", contract_type), ("gender", gender)):
+        if value:
+            mask &= columns[field] == value.lower()
+    for field, value in (("position", position), ("full_name", search)):
+        if value:
+            mask &= np.char.find(columns[field], value.lower()) >= 0
+    
+    if min_age is not None or max_age is not None:
+        today = datetime.now()
+        birthday_ahead = (columns["dob_month"] > today.month) | (
+            (columns["dob_month"] == today.month) & (columns["dob_day"] > today.day))
+        age = today.year - columns["dob_year"] - birthday_ahead
+        mask &= columns["dob_valid"]
+        if min_age is not None:
+            mask &= age >= min_age
+        if max_age is not None:
+            mask &= age <= max_age
+    
+    return mask
+
+
 class EmployeeService:
     """Service class for employee data management with per-user encryption."""
     
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.storage_dir = os.path.join(self.base_dir, "storage")
+        # Decrypted lists per user:
+        # {username: (file signature, password tag, employees, Id_number -> position)}.
+        # An entry is only used while the encrypted file is unchanged on disk and
+        # for the same password it was decrypted with.
+        self._cache: Dict[str, Tuple[Tuple[int, int], bytes, List[Dict[str, Any]], Dict[Any, int]]] = {}
+        # One lock per user, so a user's cold load (key derivation and
+        # decryption) never holds up another user's requests
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._user_locks_guard = threading.Lock()
+        # Statistics per user with the cached list they were computed from;
+        # reused while that list is still the cached one
+        self._stats_cache: Dict[str, Tuple[List[Dict[str, Any]], Dict[str, Any]]] = {}
+        # Filter columns per user, kept the same way as the statistics
+        self._columns_cache: Dict[str, Tuple[List[Dict[str, Any]], Dict[str, np.ndarray]]] = {}
+        # Encoded employees per user (see filter_employees_encoded), kept the
+        # same way, with the encoder they were produced by
+        self._encoded_cache: Dict[str, Tuple[List[Dict[str, Any]], Callable, List[Optional[bytes]]]] = {}
     
-    def load_employees(self, username: str, password: str) -> List[Dict[str, Any]]:
-        """Load employee data for a specific user (decrypted)."""
+    def _file_signature(self, username: str) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) of the user's encrypted file, or None if it doesn't exist"""
+        encrypted_file, _ = encryption_service._get_user_files(username)
         try:
-            print(f"Loading employees for user: {username}")
+            st = os.stat(encrypted_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+    
+    def _user_lock(self, username: str) -> threading.RLock:
+        """The lock guarding a user's cached data and file"""
+        with self._user_locks_guard:
+            return self._user_locks.setdefault(username, threading.RLock())
+    
+    @staticmethod
+    def _password_tag(password: str) -> bytes:
+        return hashlib.sha256(password.encode()).digest()
+    
+    @staticmethod
+    def _copy_employees(employees: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Callers mutate the returned dicts in place, so never hand out cached ones
+        return [dict(emp) for emp in employees]
+    
+    @staticmethod
+    def _build_id_index(employees: List[Dict[str, Any]]) -> Dict[Any, int]:
+        """Position of the first employee with each Id_number"""
+        id_index: Dict[Any, int] = {}
+        for i, emp in enumerate(employees):
+            id_index.setdefault(emp.get("Id_number"), i)
+        return id_index
+    
+    def _read_indexed(self, username: str, password: str) -> Tuple[List[Dict[str, Any]], Dict[Any, int]]:
+        """
+        Decrypted employees with their Id_number -> position index (empty for a
+        user without data). Cache hits return the cached objects themselves, so
+        callers must not mutate them. Raises PermissionError when the user's
+        file exists but can't be decrypted with this password.
+        """
+        print(f"Loading employees for user: {username}")
+        signature = self._file_signature(username)
+        tag = self._password_tag(password)
+        with self._user_lock(username):
+            cached = self._cache.get(username)
+            if cached is not None and signature is not None and cached[0] == signature and cached[1] == tag:
+                return cached[2], cached[3]
+            
             employees = encryption_service.decrypt_data(username, password)
             if employees is None:
-                print(f"No encrypted data found for user: {username}")
-                return []
-            return employees
+                raise PermissionError(f"Cannot decrypt employee data for user {username}: wrong password or corrupt file")
+            id_index = self._build_id_index(employees)
+            if signature is not None:
+                self._cache[username] = (signature, tag, employees, id_index)
+            return employees, id_index
+    
+    def _load_indexed(self, username: str, password: str) -> Tuple[List[Dict[str, Any]], Dict[Any, int]]:
+        """Like _read_indexed, but data that can't be read counts as no data (for reads only)"""
+        try:
+            return self._read_indexed(username, password)
         except Exception as e:
             print(f"Error loading employees for {username}: {e}")
-            return []
+            return [], {}
+    
+    def load_employees(self, username: str, password: str) -> List[Dict[str, Any]]:
+        """Load employee data for a specific user (decrypted)."""
+        employees, _ = self._load_indexed(username, password)
+        return self._copy_employees(employees)
     
     def save_employees(self, username: str, password: str, employees: List[Dict[str, Any]]) -> bool:
         """Save employee data for a specific user (encrypted)."""
         try:
             print(f"Saving {len(employees)} employees for user: {username}")
-            success = encryption_service.save_encrypted_data(username, employees, password)
-            if success:
-                print(f"Successfully saved employees for {username}")
+            with self._user_lock(username):
+                self._cache.pop(username, None)
+                success = encryption_service.save_encrypted_data(username, employees, password)
+                if success:
+                    signature = self._file_signature(username)
+                    if signature is not None:
+                        self._cache[username] = (
+                            signature,
+                            self._password_tag(password),
+                            self._copy_employees(employees),
+                            self._build_id_index(employees),
+                        )
+                    print(f"Successfully saved employees for {username}")
             return success
         except Exception as e:
             print(f"Error saving employees for {username}: {e}")
             return False
     
-    def get_employee_by_id(self, username: str, password: str, employee_id: str) -> Optional[Dict[str, Any]]:
-        """Get a specific employee by ID for a user."""
-        employees = self.load_employees(username, password)
-        for employee in employees:
-            if employee.get("employeeNo") == employee_id:
-                return employee
-        return None
-    
-    def add_employee(self, username: str, password: str, employee_data: Dict[str, Any]) -> bool:
-        """Add a new employee for a user."""
-        employees = self.load_employees(username, password)
-        employees.append(employee_data)
-        return self.save_employees(username, password, employees)
-    
-    def update_employee(self, username: str, password: str, employee_id: str, updated_data: Dict[str, Any]) -> bool:
-        """Update an existing employee for a user."""
-        employees = self.load_employees(username, password)
-        for i, employee in enumerate(employees):
-            if employee.get("employeeNo") == employee_id:
-                employees[i] = {**employee, **updated_data}
-                return self.save_employees(username, password, employees)
-        return False
-    
-    def delete_employee(self, username: str, password: str, employee_id: str) -> bool:
-        """Delete an employee by ID for a user."""
-        employees = self.load_employees(username, password)
-        employees = [emp for emp in employees if emp.get("employeeNo") != employee_id]
-        return self.save_employees(username, password, employees)
+    def _modify_employees(
+        self,
+        username: str,
+        password: str,
+        modify: Callable[[List[Dict[str, Any]], Dict[Any, int]], Optional[List[Dict[str, Any]]]],
+    ) -> bool:
+        """
+        Load, modify and save a user's employees as one step under the user's lock.
+        `modify` gets a copy of the list and its Id_number -> position index, and
+        returns the new list, or None to leave the data unchanged.
+        Returns whether the data changed; raises OSError if it could not be saved,
+        and PermissionError (saving nothing) if the existing data can't be
+        decrypted, so a wrong password never overwrites it.
+        """
+        with self._user_lock(username):
+            employees, id_index = self._read_indexed(username, password)
+            employees = modify(self._copy_employees(employees), id_index)
+            if employees is None:
+                return False
+            if not self.save_employees(username, password, employees):
+                raise OSError(f"Failed to save employees for user: {username}")
+            return True
+    
+    def get_employee_by_id_number(self, username: str, password: str, id_number: str) -> Optional[Dict[str, Any]]:
+        """Get a specific employee by Id_number for a user."""
+        with self._user_lock(username):
+            employees, id_index = self._load_indexed(username, password)
+            idx = id_index.get(id_number)
+            return dict(employees[idx]) if idx is not None else None
+    
+    def get_statistics(self, username: str, password: str) -> Dict[str, Any]:
+        """
+        Employee statistics for a user (see compute_statistics), recomputed
+        only after the employees change. The result is shared: never modify it.
+        """
+        with self._user_lock(username):
+            employees, _ = self._load_indexed(username, password)
+            cached = self._stats_cache.get(username)
+            if cached is not None and cached[0] is employees:
+                return cached[1]
+            
+            stats = compute_statistics(employees)
+            cached = self._cache.get(username)
+            if cached is not None and cached[2] is employees:
+                self._stats_cache[username] = (employees, stats)
+            return stats
+    
+    def _filter_positions(self, username: str, password: str, filters: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        The cached employees and the positions of those matching the filters.
+        Call with the user's lock held; the list is shared, so never modify it.
+        """
+        employees, _ = self._load_indexed(username, password)
+        cached = self._columns_cache.get(username)
+        if cached is not None and cached[0] is employees:
+            columns = cached[1]
+        else:
+            columns = build_filter_columns(employees)
+            cached = self._cache.get(username)
+            if cached is not None and cached[2] is employees:
+                self._columns_cache[username] = (employees, columns)
+        return employees, np.flatnonzero(filter_mask(columns, **filters))
+    
+    def filter_employees(self, username: str, password: str, **filters: Any) -> List[Dict[str, Any]]:
+        """
+        A user's employees matching the given filters (see filter_mask), in
+        stored order. The filter columns are rebuilt only after the employees change.
+        """
+        with self._user_lock(username):
+            employees, positions = self._filter_positions(username, password, filters)
+            return [dict(employees[i]) for i in positions]
+    
+    def filter_employees_encoded(
+        self,
+        username: str,
+        password: str,
+        encode: Callable[[Dict[str, Any]], bytes],
+        window: slice = slice(None),
+        **filters: Any,
+    ) -> Tuple[int, List[bytes]]:
+        """
+        Like filter_employees, but returns the number of matches and only the
+        matches within `window` (e.g. one page), each as encode(employee).
+        Only those are encoded, each at most once until the employees change.
+        """
+        with self._user_lock(username):
+            employees, positions = self._filter_positions(username, password, filters)
+            cached = self._encoded_cache.get(username)
+            if cached is not None and cached[0] is employees and cached[1] is encode:
+                encoded = cached[2]
+            else:
+                encoded = [None] * len(employees)
+                cached = self._cache.get(username)
+                if cached is not None and cached[2] is employees:
+                    self._encoded_cache[username] = (employees, encode, encoded)
+            
+            page = positions[window]
+            for i in page:
+                if encoded[i] is None:
+                    encoded[i] = encode(employees[i])
+            return len(positions), [encoded[i] for i in page]
+    
+    def add_employee(self, username: str, password: str, employee_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Add an employee for a user unless one with the same Id_number exists.
+        A contract_id of None is numbered from the current employee count.
+        Returns the stored employee, or None if the Id_number is taken.
+        """
+        added = []
+        def modify(employees, id_index):
+            if employee_data.get("Id_number") in id_index:
+                return None
+            employee = dict(employee_data)
+            if employee.get("contract_id") is None:
+                employee["contract_id"] = f"{len(employees)+1:02d}-{datetime.now().strftime('%m%Y')}/HĐLĐ/KXĐ"
+            added.append(employee)
+            return employees + [employee]
+        return dict(added[0]) if self._modify_employees(username, password, modify) else None
+    
+    def update_employee(self, username: str, password: str, id_number: str, updated_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Update the employee with the given Id_number for a user.
+        Returns the updated employee, or None if there is none.
+        """
+        updated = []
+        def modify(employees, id_index):
+            idx = id_index.get(id_number)
+            if idx is None:
+                return None
+            employees[idx] = {**employees[idx], **updated_data}
+            updated.append(employees[idx])
+            return employees
+        return dict(updated[0]) if self._modify_employees(username, password, modify) else None
+    
+    def delete_employee(self, username: str, password: str, id_number: str) -> bool:
+        """Delete every employee with the given Id_number for a user; False if there is none."""
+        def modify(employees, id_index):
+            if id_number not in id_index:
+                return None
+            return [emp for emp in employees if emp.get("Id_number") != id_number]
+        return self._modify_employees(username, password, modify)
 
 # Create a singleton instance
 employee_service = EmployeeService()
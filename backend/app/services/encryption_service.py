@@ -3,15 +3,48 @@ Encryption service for securing employee data using AES-256 encryption.
 Only users with correct password can decrypt the data.
 """
 import os
-import json
 import base64
+import struct
 import hashlib
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import orjson
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 
+from .file_utils import atomic_write_bytes
+
+
+# Number of derived keys kept in memory
+KEY_CACHE_SIZE = 128
+
+# PBKDF2 work factor for newly written files, overridable via PBKDF2_ITERATIONS.
+# Every file records the count it was written with, so changing this only
+# affects files saved afterwards. Lower values make each uncached key
+# derivation (first access after a restart or password change) cheaper, at
+# the price of faster offline password guessing if the storage files leak.
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "100000"))
+# Legacy Fernet files always used this
+LEGACY_PBKDF2_ITERATIONS = 100_000
+
+# Encrypted file layout (raw bytes):
+#   version (1) | iterations (4, big-endian) | salt (16) | nonce (12) | AES-256-GCM ciphertext + tag
+# The username is bound as associated data. Legacy files are base64 text of
+# salt + Fernet token; base64 never produces a byte below 0x2B, so the leading
+# version byte tells the formats apart.
+FORMAT_VERSION = b"\x03"
+SALT_SIZE = 16
+NONCE_SIZE = 12
+_ITERATIONS = struct.Struct(">I")
+
+# Bound once instead of looked up for every key derivation
+_BACKEND = default_backend()
+
 
 class EncryptionService:
     """Service for encrypting and decrypting employee data"""
@@ -19,6 +52,13 @@ class EncryptionService:
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.storage_dir = os.path.join(self.base_dir, "storage")
+        # PBKDF2 is deliberately slow, so derived keys are cached per
+        # (sha256(password), salt, iterations); the plaintext password is never
+        # kept. Each user's last salt is reused on save so a load + save pair
+        # derives the key only once.
+        self._key_cache: "OrderedDict[Tuple[bytes, bytes, int], bytes]" = OrderedDict()
+        self._user_salts: Dict[str, bytes] = {}
+        self._cache_lock = threading.Lock()
     
     def _get_user_files(self, username: str) -> tuple:
         """Get file paths for a specific user"""
@@ -26,18 +66,89 @@ class EncryptionService:
         plain_file = os.path.join(self.storage_dir, f"nhan_vien_{username}.json")
         return encrypted_file, plain_file
         
-    def _derive_key(self, password: str, salt: bytes) -> bytes:
-        """Derive encryption key from password using PBKDF2"""
+    def _derive_key(self, password: str, salt: bytes, iterations: int) -> bytes:
+        """Derive a raw 32-byte encryption key from password using PBKDF2"""
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
             salt=salt,
-            iterations=100000,
-            backend=default_backend()
+            iterations=iterations,
+            backend=_BACKEND
         )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        return kdf.derive(password.encode())
+    
+    def get_key(self, password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
+        """
+        Get the raw key for password + salt, deriving it only on a cache miss
+        Shared by the other services that encrypt per-user files
+        """
+        cache_key = (hashlib.sha256(password.encode()).digest(), salt, iterations)
+        with self._cache_lock:
+            key = self._key_cache.get(cache_key)
+            if key is not None:
+                self._key_cache.move_to_end(cache_key)
+                return key
+        
+        key = self._derive_key(password, salt, iterations)
+        with self._cache_lock:
+            self._key_cache[cache_key] = key
+            if len(self._key_cache) > KEY_CACHE_SIZE:
+                self._key_cache.popitem(last=False)
         return key
     
+    def _salt_for_save(self, username: str) -> bytes:
+        """Reuse the user's current salt (keeps the cached key valid), else a new one"""
+        return self._user_salts.get(username) or os.urandom(SALT_SIZE)
+    
+    def encrypt_bytes(self, plaintext: bytes, password: str, salt: bytes, associated_data: bytes) -> bytes:
+        """
+        Encrypt plaintext into the versioned AES-GCM file layout
+        associated_data is authenticated (not stored) and must match on decrypt
+        """
+        key = self.get_key(password, salt, PBKDF2_ITERATIONS)
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = AESGCM(key).encrypt(nonce, plaintext, associated_data)
+        return FORMAT_VERSION + _ITERATIONS.pack(PBKDF2_ITERATIONS) + salt + nonce + ciphertext
+    
+    def decrypt_bytes(self, blob: bytes, password: str, associated_data: bytes) -> Tuple[bytes, bytes]:
+        """
+        Decrypt a file's contents (current or legacy base64 Fernet format)
+        Returns (plaintext, salt); raises on a wrong password or corrupt data
+        """
+        if blob[:1] == FORMAT_VERSION:
+            (iterations,) = _ITERATIONS.unpack_from(blob, 1)
+            salt_start = 1 + _ITERATIONS.size
+            salt_end = salt_start + SALT_SIZE
+            nonce_end = salt_end + NONCE_SIZE
+            salt = blob[salt_start:salt_end]
+            key = self.get_key(password, salt, iterations)
+            plaintext = AESGCM(key).decrypt(blob[salt_end:nonce_end], blob[nonce_end:], associated_data)
+            return plaintext, salt
+        
+        # Legacy: base64(salt + Fernet token)
+        combined = base64.b64decode(blob)
+        return self.decrypt_fernet(combined[SALT_SIZE:], password, combined[:SALT_SIZE]), combined[:SALT_SIZE]
+    
+    def decrypt_fernet(self, token: bytes, password: str, salt: bytes) -> bytes:
+        """Decrypt a legacy Fernet token; its key is the urlsafe-b64 100k-iteration PBKDF2 output"""
+        key = self.get_key(password, salt, LEGACY_PBKDF2_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(key)).decrypt(token)
+    
+    def _write_encrypted(self, username: str, password: str, data: List[Dict[str, Any]], salt: bytes) -> str:
+        """Serialize, encrypt and write a user's data; returns the file path"""
+        encrypted_file, _ = self._get_user_files(username)
+        
+        # Serialize to compact UTF-8 JSON bytes (nobody reads the plaintext
+        # layout, and indentation only inflates the ciphertext)
+        json_bytes = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        blob = self.encrypt_bytes(json_bytes, password, salt, username.encode())
+        
+        # Save encrypted file as raw bytes, swapped in atomically
+        atomic_write_bytes(encrypted_file, blob)
+        
+        self._user_salts[username] = salt
+        return encrypted_file
+    
     def encrypt_data(self, username: str, password: str, data: Optional[List[Dict[str, Any]]] = None) -> bool:
         """
         Encrypt employee data for a specific user
@@ -52,33 +163,11 @@ class EncryptionService:
                     print(f"Plain file not found: {plain_file}")
                     return False
                     
-                with open(plain_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            
-            # Convert to JSON string
-            json_str = json.dumps(data, ensure_ascii=False, indent=2)
-            
-            # Generate salt
-            salt = os.urandom(16)
-            
-            # Derive key from password
-            key = self._derive_key(password, salt)
+                with open(plain_file, 'rb') as f:
+                    data = orjson.loads(f.read())
             
-            # Create Fernet cipher
-            cipher = Fernet(key)
-            
-            # Encrypt data
-            encrypted_data = cipher.encrypt(json_str.encode('utf-8'))
-            
-            # Combine salt + encrypted data
-            combined = salt + encrypted_data
-            
-            # Encode to base64 for storage
-            encoded = base64.b64encode(combined).decode('utf-8')
-            
-            # Save encrypted file
-            with open(encrypted_file, 'w', encoding='utf-8') as f:
-                f.write(encoded)
+            # Encrypt with a fresh salt
+            self._write_encrypted(username, password, data, os.urandom(SALT_SIZE))
             
             print(f"Data encrypted successfully for user '{username}': {encrypted_file}")
             return True
@@ -100,34 +189,21 @@ class EncryptionService:
                 print(f"Encrypted file not found: {encrypted_file}")
                 # If no encrypted file, try to read plain file
                 if os.path.exists(plain_file):
-                    with open(plain_file, 'r', encoding='utf-8') as f:
-                        return json.load(f)
+                    with open(plain_file, 'rb') as f:
+                        return orjson.loads(f.read())
                 # Return empty array for new users
                 return []
             
             # Read encrypted file
-            with open(encrypted_file, 'r', encoding='utf-8') as f:
-                encoded = f.read()
-            
-            # Decode from base64
-            combined = base64.b64decode(encoded)
+            with open(encrypted_file, 'rb') as f:
+                blob = f.read()
             
-            # Extract salt and encrypted data
-            salt = combined[:16]
-            encrypted_data = combined[16:]
+            # Decrypt with the password-derived key (cached per password + salt)
+            decrypted_bytes, salt = self.decrypt_bytes(blob, password, username.encode())
+            self._user_salts[username] = salt
             
-            # Derive key from password
-            key = self._derive_key(password, salt)
-            
-            # Create Fernet cipher
-            cipher = Fernet(key)
-            
-            # Decrypt data
-            decrypted_bytes = cipher.decrypt(encrypted_data)
-            json_str = decrypted_bytes.decode('utf-8')
-            
-            # Parse JSON
-            data = json.loads(json_str)
+            # Parse JSON straight from the UTF-8 bytes
+            data = orjson.loads(decrypted_bytes)
             
             print(f"Data decrypted successfully for user '{username}'")
             return data
@@ -147,31 +223,8 @@ class EncryptionService:
         Used when updating employee data
         """
         try:
-            encrypted_file, _ = self._get_user_files(username)
-            # Convert to JSON string
-            json_str = json.dumps(data, ensure_ascii=False, indent=2)
-            
-            # Generate salt
-            salt = os.urandom(16)
-            
-            # Derive key from password
-            key = self._derive_key(password, salt)
-            
-            # Create Fernet cipher
-            cipher = Fernet(key)
-            
-            # Encrypt data
-            encrypted_data = cipher.encrypt(json_str.encode('utf-8'))
-            
-            # Combine salt + encrypted data
-            combined = salt + encrypted_data
-            
-            # Encode to base64 for storage
-            encoded = base64.b64encode(combined).decode('utf-8')
-            
-            # Save encrypted file
-            with open(encrypted_file, 'w', encoding='utf-8') as f:
-                f.write(encoded)
+            # Reuse the user's salt so the cached key applies
+            self._write_encrypted(username, password, data, self._salt_for_save(username))
             
             print(f"Encrypted data saved successfully for user '{username}'")
             return True
@@ -3,13 +3,58 @@ Excel file exporter for employee salary data.
 Generates Excel files using a template to preserve formatting.
 """
 import io
-from typing import List
+from copy import copy
+from functools import lru_cache
+from typing import Any, Dict, List
 from pathlib import Path
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
 from ..models.schemas import SelectEmployee
 
 
+# Path to the template file - relative to this file's location
+# This file is at: backend/app/services/excel_exporter.py
+# Template is at: backend/templates/salary_template.xlsx
+TEMPLATE_PATH = Path(__file__).parent.parent.parent / "templates" / "salary_template.xlsx"
+
+
+@lru_cache(maxsize=None)
+def _template_bytes() -> bytes:
+    """Read the template file once; later exports parse it from memory."""
+    return TEMPLATE_PATH.read_bytes()
+
+
+def export_records_to_excel(records: List[Dict[str, Any]], sheet_name: str) -> bytes:
+    """
+    Export dict records to a single-sheet workbook laid out like
+    DataFrame.to_excel(index=False): a header row with every key in
+    first-seen order, then one row per record (missing values left empty).
+    
+    Rows are streamed through a write-only workbook, so no cell objects are
+    kept in memory while the file is written.
+    
+    Args:
+        records: Rows to export
+        sheet_name: Title of the worksheet
+        
+    Returns:
+        Bytes content of the Excel file
+    """
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    
+    worksheet.append(columns)
+    
+    for record in records:
+        worksheet.append([record.get(column) for column in columns])
+    
+    output_buffer = io.BytesIO()
+    workbook.save(output_buffer)
+    return output_buffer.getvalue()
+
+
 def export_employees_to_excel(employees: List[SelectEmployee]) -> bytes:
     """
     Export employees to Excel format using the template file and preserving its format.
@@ -20,39 +65,34 @@ def export_employees_to_excel(employees: List[SelectEmployee]) -> bytes:
     Returns:
         Bytes content of the Excel file
     """
-    # Path to the template file - relative to this file's location
-    # This file is at: backend/app/services/excel_exporter.py
-    # Template is at: backend/templates/salary_template.xlsx
-    current_file_dir = Path(__file__).parent  # app/services/
-    backend_dir = current_file_dir.parent.parent  # backend/
-    template_path = backend_dir / "templates" / "salary_template.xlsx"
-    
-    # Load the template Excel file
-    workbook = load_workbook(template_path)
+    # Load the template Excel file from the cached bytes. The template has no
+    # macros or external links, so skip looking for them; formulas stay as
+    # formulas and cell text is read as plain strings.
+    workbook = load_workbook(
+        io.BytesIO(_template_bytes()),
+        keep_vba=False,
+        data_only=False,
+        keep_links=False,
+        rich_text=False,
+    )
     worksheet: Worksheet = workbook.active
     
     # Start writing data from row 2 (row 1 has headers)
     start_row = 2
     
-    # Save formatting from row 2 if it exists (use as template for all data rows)
-    row_format_template = {}
+    # Save formatting from row 2 if it exists (use as template for all data rows).
+    # Each cell's StyleArray holds the ids of its font/alignment/border/fill/
+    # number format in the workbook's shared style tables, so one assignment
+    # per cell restores the whole column style without copying style objects.
+    column_styles = []
     if worksheet.max_row >= 2:
-        for col in range(1, 27):
-            cell = worksheet.cell(row=2, column=col)
-            row_format_template[col] = {
-                'number_format': cell.number_format,
-                'font': cell.font.copy() if cell.font else None,
-                'alignment': cell.alignment.copy() if cell.alignment else None,
-                'border': cell.border.copy() if cell.border else None,
-                'fill': cell.fill.copy() if cell.fill else None
-            }
+        column_styles = [copy(worksheet.cell(row=2, column=col)._style) for col in range(1, 27)]
     
-    # Clear all existing data rows (keep header)
+    # Remove all existing data rows (keep header) in one call; the row 2
+    # styles were captured above
     # This ensures we don't have leftover data from the template
     if worksheet.max_row > 1:
-        for row_to_clear in range(2, worksheet.max_row + 1):
-            for col in range(1, 27):
-                worksheet.cell(row=row_to_clear, column=col).value = None
+        worksheet.delete_rows(2, worksheet.max_row - 1)
     
     # Now write the new data
     for idx, emp in enumerate(employees, 1):
@@ -69,49 +109,41 @@ def export_employees_to_excel(employees: List[SelectEmployee]) -> bytes:
         # Formula: personalRelief + dependentRelief + employeeInsurance
         pit_non_taxable_income = emp.personalRelief + emp.dependentRelief + emp.employeeInsurance
         
-        # Fill in the data - just values, no formatting changes
-        worksheet.cell(row=row, column=1).value = idx  # STT
-        worksheet.cell(row=row, column=2).value = emp.employeeNo  # No.
-        worksheet.cell(row=row, column=3).value = emp.name  # Name
-        worksheet.cell(row=row, column=4).value = emp.salary  # Salary
-        worksheet.cell(row=row, column=5).value = emp.augSalary  # Aug's salary
-        worksheet.cell(row=row, column=6).value = emp.bonus  # Bonus
-        worksheet.cell(row=row, column=7).value = emp.allowanceTax  # Allowance tính thuế
-        worksheet.cell(row=row, column=8).value = emp.overtimePayPIT  # Over time Pay PIT
-        worksheet.cell(row=row, column=9).value = emp.totalSalary  # Total Salary
-        worksheet.cell(row=row, column=10).value = emp.dependants  # Dependants
-        worksheet.cell(row=row, column=11).value = emp.personalRelief  # Personal relief
-        worksheet.cell(row=row, column=12).value = emp.dependentRelief  # Dependent relief
-        worksheet.cell(row=row, column=13).value = emp.assessableIncome  # Assessable income
-        worksheet.cell(row=row, column=14).value = pit_non_taxable_income  # thu nhập ko tính thuế (PIT)
-        worksheet.cell(row=row, column=15).value = emp.personalIncomeTax  # Personal Income tax
-        worksheet.cell(row=row, column=16).value = emp.companyInsurance  # Insurance - Company's pay
-        worksheet.cell(row=row, column=17).value = emp.employeeInsurance  # Insurance - Employee's pay
-        worksheet.cell(row=row, column=18).value = emp.unionFee  # Đoàn phí
-        worksheet.cell(row=row, column=19).value = emp.overtimePayNonPIT  # Over time none pay PIT
-        worksheet.cell(row=row, column=20).value = emp.advance  # Trừ Adv
-        worksheet.cell(row=row, column=21).value = emp.totalNetIncome  # Total Net Income
-        worksheet.cell(row=row, column=22).value = he_so  # He so
-        worksheet.cell(row=row, column=23).value = emp.ot15  # OT ( 1.5 % )
-        worksheet.cell(row=row, column=24).value = emp.ot20  # OT( 2.0%)
-        worksheet.cell(row=row, column=25).value = emp.ot30  # OT( 3.0%)
-        worksheet.cell(row=row, column=26).value = total_ot_hours  # Total OT hours
+        # Row values in template column order
+        values = (
+            idx,  # STT
+            emp.employeeNo,  # No.
+            emp.name,  # Name
+            emp.salary,  # Salary
+            emp.augSalary,  # Aug's salary
+            emp.bonus,  # Bonus
+            emp.allowanceTax,  # Allowance tính thuế
+            emp.overtimePayPIT,  # Over time Pay PIT
+            emp.totalSalary,  # Total Salary
+            emp.dependants,  # Dependants
+            emp.personalRelief,  # Personal relief
+            emp.dependentRelief,  # Dependent relief
+            emp.assessableIncome,  # Assessable income
+            pit_non_taxable_income,  # thu nhập ko tính thuế (PIT)
+            emp.personalIncomeTax,  # Personal Income tax
+            emp.companyInsurance,  # Insurance - Company's pay
+            emp.employeeInsurance,  # Insurance - Employee's pay
+            emp.unionFee,  # Đoàn phí
+            emp.overtimePayNonPIT,  # Over time none pay PIT
+            emp.advance,  # Trừ Adv
+            emp.totalNetIncome,  # Total Net Income
+            he_so,  # He so
+            emp.ot15,  # OT ( 1.5 % )
+            emp.ot20,  # OT( 2.0%)
+            emp.ot30,  # OT( 3.0%)
+            total_ot_hours,  # Total OT hours
+        )
         
-        # Apply the saved formatting from template row 2 to all data rows
-        if row_format_template:
-            for col in range(1, 27):
-                cell = worksheet.cell(row=row, column=col)
-                fmt = row_format_template[col]
-                if fmt['number_format']:
-                    cell.number_format = fmt['number_format']
-                if fmt['font']:
-                    cell.font = fmt['font']
-                if fmt['alignment']:
-                    cell.alignment = fmt['alignment']
-                if fmt['border']:
-                    cell.border = fmt['border']
-                if fmt['fill']:
-                    cell.fill = fmt['fill']
+        # Write values and apply the saved row 2 style of each column
+        for col, value in enumerate(values, 1):
+            cell = worksheet.cell(row=row, column=col, value=value)
+            if column_styles:
+                cell._style = copy(column_styles[col - 1])
     
     # Save to bytes
     output = io.BytesIO()
@@ -2,72 +2,215 @@
 Excel file parser for employee data import.
 Based on the reference abc.py implementation.
 """
+import numpy as np
 import pandas as pd
 import io
-from typing import List, Dict, Any
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
 
 
-def parse_excel_file(file_content: bytes) -> List[Dict[str, Any]]:
+# Runs of whitespace in column headers (collapsed to one space)
+_WS_RE = re.compile(r"\s+")
+
+# Accepted column names per field, in order of preference
+# Map Excel columns to our employee model, handling variations in column names
+EMPLOYEE_NO_COLUMNS = ("No.", "No", "Employee No", "Employee No.")
+NAME_COLUMNS = ("Name", "Name ", "Employee Name", "Full Name")
+
+# Numeric fields: (field, column aliases, default)
+NUMERIC_FIELDS: Tuple[Tuple[str, Tuple[str, ...], float], ...] = (
+    ("salary", ("Salary", "Salary ", "Base Salary", "Basic Salary"), 0),
+    ("bonus", ("Bonus", "Bonus ", "Bonuses"), 0),
+    ("allowanceTax", ("Allowance tính thuế", "Allowance", "Allowance Tax"), 0),
+    ("ot15", ("OT ( 1.5 % )", "OT(1.5%)", "OT 1.5", "OT15"), 0),
+    ("ot20", ("OT( 2.0%)", "OT(2.0%)", "OT 2.0", "OT20"), 0),
+    ("ot30", ("OT( 3.0%)", "OT( 3.0%) ", "OT(3.0%)", "OT 3.0", "OT30"), 0),
+    ("dependants", ("Dependants", "Dependents", "Number of Dependants"), 0),
+    ("advance", ("Trừ Adv", "Advance", "Adv", "Advances"), 0),
+    # Additional fields from Excel that should be extracted (as per abc.py)
+    ("personalRelief", ("Personal relief", "Personal \nrelief"), 11000000),
+    ("dependentRelief", ("Dependent relief", "Dependent \nrelief"), 0),
+    # New fields for company insurance and He so coefficient
+    ("companyInsurance", ("Insurance contribution - Company's pay (21.5%)",
+                          "Company Insurance", "Company's Insurance"), 0),
+    ("heSo", ("He so", "Heso", "He So"), 0),
+)
+
+
+def _read_sheet(file_content: bytes) -> pd.DataFrame:
     """
-    Parse Excel file and extract employee data.
+    Read the first worksheet into a DataFrame (first row = headers).
+    
+    Goes through pd.read_excel on purpose: its type inference (int columns
+    with blanks become floats, booleans among numbers become numbers,
+    numeric-looking text such as "1e3" is converted) and its errors for
+    malformed files are what the per-field rules below were written against.
+    """
+    return pd.read_excel(io.BytesIO(file_content))
+
+
+def _cell_kind(value: Any) -> int:
+    """0 for a blank cell, 1 for a date(time) or NaT, 2 for anything else"""
+    if value is None or (isinstance(value, float) and value != value):
+        return 0
+    if isinstance(value, datetime) or value is pd.NaT:
+        return 1
+    return 2
+
+
+def _as_rows_typed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The sheet's values as the row-by-row parser saw them. It read each row
+    as a Series built from the frame's common dtype, so:
+    - when every column is numeric, ints were read as floats ("7" -> "7.0"
+      in the id and name columns);
+    - otherwise a row whose values are all dates or blanks became a
+      datetime row: its dates turn into Timestamps and its blanks into NaT,
+      which counts as a value ("NaT" name, float() error).
+    """
+    row_dtype = df.iloc[:0].to_numpy().dtype
+    if row_dtype != object:
+        return df.astype(row_dtype)
+    
+    values = df.to_numpy(dtype=object, copy=True)
+    kinds = np.fromiter(map(_cell_kind, values.ravel()), dtype=np.int8, count=values.size).reshape(values.shape)
+    date_rows = (kinds != 2).all(axis=1) & (kinds == 1).any(axis=1)
+    if not date_rows.any():
+        return df
+    
+    for i in np.flatnonzero(date_rows):
+        values[i] = [pd.NaT if kind == 0 else pd.Timestamp(value) for value, kind in zip(values[i], kinds[i])]
+    return pd.DataFrame(values, columns=df.columns, dtype=object)
+
+
+def _column_indices(columns: Sequence[str], aliases: Sequence[str]) -> Tuple[int, ...]:
+    """Positions of the alias columns present in the sheet, in alias order."""
+    positions = {}
+    for i, column in enumerate(columns):
+        positions.setdefault(column, i)
+    return tuple(positions[alias] for alias in aliases if alias in positions)
+
+
+def _present_mask(column: pd.Series) -> np.ndarray:
+    """
+    Cells that count as a value: not None, not blank and not 'nan' once
+    converted to str (the rules the row-by-row parser applied per cell).
+    """
+    kind = column.dtype.kind
+    if kind in "iubMm":
+        # Integers, booleans and datetimes (including NaT) always print as something
+        return np.ones(len(column), dtype=bool)
+    if kind == "f":
+        return column.notna().to_numpy()
+    
+    # Text / mixed columns: apply the str() rules cell by cell
+    return np.fromiter(
+        (value is not None and str(value).strip() != "" and str(value) != "nan"
+         for value in column.to_numpy(dtype=object)),
+        dtype=bool,
+        count=len(column),
+    )
+
+
+def _coalesce(df: pd.DataFrame, indices: Tuple[int, ...], default: Any) -> np.ndarray:
+    """
+    Per row, the first present value among the columns at `indices`, else `default`
+    (a scalar, or an array with one default per row).
+    """
+    values = np.empty(len(df), dtype=object)
+    values[:] = default
+    missing = np.ones(len(df), dtype=bool)
+    for i in indices:
+        column = df.iloc[:, i]
+        present = _present_mask(column)
+        take = missing & present
+        values[take] = column.to_numpy(dtype=object)[take]
+        missing &= ~present
+        if not missing.any():
+            break
+    return values
+
+
+def _to_float(values: np.ndarray) -> np.ndarray:
+    """float(value or 0) for every value, in one cast when the values are all numeric."""
+    numeric = pd.Series(values).infer_objects()
+    if numeric.dtype.kind in "iubf":
+        return numeric.to_numpy(dtype=np.float64)
+    return np.array([float(value or 0) for value in values], dtype=np.float64)
+
+
+def parse_excel_columns(file_content: bytes) -> Dict[str, Any]:
+    """
+    Parse Excel file into per-field arrays (one entry per employee, aligned by index).
     
     Args:
         file_content: The Excel file content as bytes
     
     Returns:
-        List of employee dictionaries ready for database insertion
+        {"ids": employee numbers, "names": names, "columns": {field: float64 array}}
+        for every row that has a name
+    
+    Gives the same results and errors as the former row-by-row parser, with
+    one deliberate difference: when two headers are the same once their
+    whitespace is normalized (e.g. "Name" and "Name "), the first of those
+    columns with a value is used. The row-by-row parser got both cells back
+    as a Series and stored its printed form as the name, or failed to
+    convert it to a number.
     """
     # Read Excel file from bytes
-    df = pd.read_excel(io.BytesIO(file_content))
+    df = _read_sheet(file_content)
+    
+    df = _as_rows_typed(df)
     
     # Normalize column headers: merge consecutive spaces and strip (following abc.py pattern)
-    df.columns = (
-        df.columns.astype(str)
-                  .str.replace(r"\s+", " ", regex=True)
-                  .str.strip()
-    )
+    df.columns = [_WS_RE.sub(" ", str(column)).strip() for column in df.columns]
+    
+    # Resolve each field column by column: pick the first present alias per
+    # row, fill the default, then cast the whole column at once
+    columns = list(df.columns)
+    row_numbers = pd.Series(np.arange(1, len(df) + 1)).astype(str)
     
-    # List to store parsed employees
-    employees = []
+    # Extract only the required fields from Excel rows (following abc.py pattern)
+    employee_no = _coalesce(df, _column_indices(columns, EMPLOYEE_NO_COLUMNS), ("EMP-" + row_numbers.str.zfill(3)).to_numpy())
+    name = _coalesce(df, _column_indices(columns, NAME_COLUMNS), ("Employee " + row_numbers).to_numpy())
+    ids = np.array([str(value) for value in employee_no], dtype=object)
+    names = np.array([str(value) for value in name], dtype=object)
     
-    # Process each row
-    for idx, row in df.iterrows():
-        # Convert idx to int for use in string formatting
-        row_num = int(idx) + 1 if isinstance(idx, (int, float)) else 1
-        
-        # Helper function to safely get values from row
-        def safe_get(row, *keys, default=None):
-            """Try multiple column names and return the first non-null value."""
-            for key in keys:
-                value = row.get(key)
-                if value is not None and str(value).strip() and str(value) != 'nan':
-                    return value
-            return default
-        
-        # Extract only the required fields from Excel row (following abc.py pattern)
-        # Map Excel columns to our employee model, handling variations in column names
-        employee_data = {
-            "employeeNo": str(safe_get(row, "No.", "No", "Employee No", "Employee No.", default=f"EMP-{row_num:03d}")),
-            "name": str(safe_get(row, "Name", "Name ", "Employee Name", "Full Name", default=f"Employee {row_num}")),
-            "salary": float(safe_get(row, "Salary", "Salary ", "Base Salary", "Basic Salary", default=0) or 0),
-            "bonus": float(safe_get(row, "Bonus", "Bonus ", "Bonuses", default=0) or 0),
-            "allowanceTax": float(safe_get(row, "Allowance tính thuế", "Allowance", "Allowance Tax", default=0) or 0),
-            "ot15": float(safe_get(row, "OT ( 1.5 % )", "OT(1.5%)", "OT 1.5", "OT15", default=0) or 0),
-            "ot20": float(safe_get(row, "OT( 2.0%)", "OT(2.0%)", "OT 2.0", "OT20", default=0) or 0),
-            "ot30": float(safe_get(row, "OT( 3.0%)", "OT( 3.0%) ", "OT(3.0%)", "OT 3.0", "OT30", default=0) or 0),
-            "dependants": float(safe_get(row, "Dependants", "Dependents", "Number of Dependants", default=0) or 0),
-            "advance": float(safe_get(row, "Trừ Adv", "Advance", "Adv", "Advances", default=0) or 0),
-            # Additional fields from Excel that should be extracted (as per abc.py)
-            "personalRelief": float(safe_get(row, "Personal relief", "Personal \nrelief", default=11000000) or 0),
-            "dependentRelief": float(safe_get(row, "Dependent relief", "Dependent \nrelief", default=0) or 0),
-            # New fields for company insurance and He so coefficient
-            "companyInsurance": float(safe_get(row, "Insurance contribution - Company's pay (21.5%)", 
-                                              "Company Insurance", "Company's Insurance", default=0) or 0),
-            "heSo": float(safe_get(row, "He so", "Heso", "He So", default=0) or 0)
-        }
-        
-        # Add to list if we have at least a name
-        if employee_data["name"] and employee_data["name"] != "nan":
-            employees.append(employee_data)
+    raw = {
+        field: _coalesce(df, _column_indices(columns, aliases), default)
+        for field, aliases, default in NUMERIC_FIELDS
+    }
+    try:
+        numeric = {field: _to_float(values) for field, values in raw.items()}
+    except (TypeError, ValueError):
+        # Raise what the row-by-row parser raised: the error of the first
+        # bad cell in row order, not in column order
+        for row in zip(*raw.values()):
+            for value in row:
+                float(value or 0)
+        raise
     
-    return employees
\ No newline at end of file
+    # Keep rows that have at least a name
+    keep = (names != "") & (names != "nan")
+    return {
+        "ids": ids[keep],
+        "names": names[keep],
+        "columns": {field: values[keep] for field, values in numeric.items()},
+    }
+
+
+def parse_excel_file(file_content: bytes) -> List[Dict[str, Any]]:
+    """
+    Parse Excel file and extract employee data.
+    
+    Args:
+        file_content: The Excel file content as bytes
+    
+    Returns:
+        List of employee dictionaries ready for database insertion
+    """
+    parsed = parse_excel_columns(file_content)
+    fields = ["employeeNo", "name", *parsed["columns"]]
+    values = [parsed["ids"].tolist(), parsed["names"].tolist(), *(column.tolist() for column in parsed["columns"].values())]
+    return [dict(zip(fields, row)) for row in zip(*values)]
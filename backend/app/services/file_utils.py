@@ -0,0 +1,37 @@
+"""
+File helpers shared by the storage-backed services.
+"""
+import os
+import tempfile
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """
+    Write data to path atomically.
+    
+    The bytes go to a temporary file in the same directory, which is then
+    swapped in with os.replace, so readers only ever see the old or the new
+    file and a crash mid-write can't leave a truncated one behind. The data is
+    fsynced before the swap, so a power loss can't leave the new name pointing
+    at unwritten data. An existing file keeps its permissions; new files are
+    created owner-only (0600).
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        # One buffered write of the whole payload
+        with os.fdopen(fd, 'wb', buffering=max(len(data), 1 << 16)) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
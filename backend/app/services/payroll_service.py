@@ -1,7 +1,21 @@
 import os
-import json
-from typing import List, Dict, Any, Optional
-from .encryption_service import encryption_service
+import zlib
+import hashlib
+import threading
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+import orjson
+
+from .encryption_service import encryption_service, SALT_SIZE
+from .file_utils import atomic_write_bytes
+from .user_service import user_service
+
+# The JSON is zlib-compressed before encryption (records repeat the same keys,
+# so it shrinks several times over) and tagged with this byte. Older files
+# hold the bare JSON array, which always starts with "[".
+_COMPRESSED_TAG = b"\x01"
+_COMPRESSION_LEVEL = 3
+
 
 class PayrollService:
     """Service class for payroll data management with per-user encryption."""
@@ -9,71 +23,154 @@ class PayrollService:
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.storage_dir = os.path.join(self.base_dir, "storage")
+        # Last salt seen per user; reusing it on save lets a load + save pair
+        # share one cached key instead of running PBKDF2 twice
+        self._user_salts: Dict[str, bytes] = {}
+        # Decrypted lists per user:
+        # {username: (file signature, password tag, employees, id -> position)}.
+        # An entry is only used while the encrypted file is unchanged on disk and
+        # for the same password it was decrypted with.
+        self._cache: Dict[str, Tuple[Tuple[int, int], bytes, List[Dict[str, Any]], Dict[Any, int]]] = {}
+        # Only held for _cache lookups and updates, never across key derivation
+        self._cache_lock = threading.Lock()
+        # One lock per user, so a user's cold load (key derivation and
+        # decryption) never holds up another user's requests
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._user_locks_guard = threading.Lock()
     
     def _get_user_files(self, username: str) -> tuple:
         """Get file paths for a specific user's payroll data"""
-        encrypted_file = os.path.join(self.storage_dir, f"payroll_{username}.encrypted")
+        encrypted_file = os.path.join(self.storage_dir, f"payroll_{username}.bin")
         plain_file = os.path.join(self.storage_dir, f"payroll_{username}.json")
         return encrypted_file, plain_file
     
-    def load_payroll_employees(self, username: str, password: str) -> List[Dict[str, Any]]:
-        """Load payroll employee data for a specific user (decrypted)."""
-        try:
-            import base64
-            from cryptography.hazmat.primitives import hashes
-            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-            from cryptography.hazmat.backends import default_backend
-            from cryptography.fernet import Fernet
+    def _get_legacy_file(self, username: str) -> str:
+        """Path of the older base64 text format, replaced by the .bin file on the next save"""
+        return os.path.join(self.storage_dir, f"payroll_{username}.encrypted")
+    
+    def _user_lock(self, username: str) -> threading.RLock:
+        """The lock guarding a user's payroll file"""
+        with self._user_locks_guard:
+            return self._user_locks.setdefault(username, threading.RLock())
+    
+    def _find_encrypted_file(self, username: str) -> Optional[Tuple[str, Tuple[int, int]]]:
+        """
+        The user's encrypted file (.bin, else legacy .encrypted) with its
+        (mtime_ns, size) signature, or None if neither exists
+        """
+        encrypted_file, _ = self._get_user_files(username)
+        for path in (encrypted_file, self._get_legacy_file(username)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            return path, (st.st_mtime_ns, st.st_size)
+        return None
+    
+    @staticmethod
+    def _associated_data(username: str) -> bytes:
+        # Bound into the AES-GCM tag so a payroll file can't pass as another
+        # user's, or as an employee data file
+        return b"payroll:" + username.encode()
+    
+    @staticmethod
+    def _password_tag(password: str) -> bytes:
+        return hashlib.sha256(password.encode()).digest()
+    
+    @staticmethod
+    def _copy_employees(employees: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Callers mutate the returned dicts in place, so never hand out cached ones
+        return [dict(emp) for emp in employees]
+    
+    @staticmethod
+    def _build_id_index(employees: List[Dict[str, Any]]) -> Dict[Any, int]:
+        """Position of the first employee with each id"""
+        id_index: Dict[Any, int] = {}
+        for i, emp in enumerate(employees):
+            id_index.setdefault(emp.get("id"), i)
+        return id_index
+    
+    def _read_indexed(self, username: str, password: str) -> Tuple[List[Dict[str, Any]], Dict[Any, int]]:
+        """
+        Decrypted employees with their id -> position index (empty for a user
+        without payroll data). Cache hits return the cached objects themselves,
+        so callers must not mutate them. Raises PermissionError when the user's
+        data exists but can't be read with this password.
+        """
+        print(f"Loading payroll employees for user: {username}")
+        
+        with self._user_lock(username):
+            # Try to decrypt from encrypted file
+            found = self._find_encrypted_file(username)
+            if found is None:
+                return self._migrate_plain_file(username, password)
             
-            print(f"Loading payroll employees for user: {username}")
+            encrypted_file, signature = found
+            tag = self._password_tag(password)
+            with self._cache_lock:
+                cached = self._cache.get(username)
+            if cached is not None and cached[0] == signature and cached[1] == tag:
+                return cached[2], cached[3]
             
-            # Try to decrypt from encrypted file
-            encrypted_file, plain_file = self._get_user_files(username)
+            # Read encrypted file
+            with open(encrypted_file, 'rb') as f:
+                blob = f.read()
             
-            if os.path.exists(encrypted_file):
-                # Read encrypted file
-                with open(encrypted_file, 'r', encoding='utf-8') as f:
-                    encoded = f.read()
-                
-                # Decode from base64
-                combined = base64.b64decode(encoded)
-                
-                # Extract salt and encrypted data
-                salt = combined[:16]
-                encrypted_data = combined[16:]
-                
-                # Derive key from password
-                kdf = PBKDF2HMAC(
-                    algorithm=hashes.SHA256(),
-                    length=32,
-                    salt=salt,
-                    iterations=100000,
-                    backend=default_backend()
-                )
-                key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-                
-                # Create Fernet cipher
-                cipher = Fernet(key)
-                
-                # Decrypt data
-                decrypted_bytes = cipher.decrypt(encrypted_data)
-                json_str = decrypted_bytes.decode('utf-8')
-                
-                # Parse JSON
-                employees = json.loads(json_str)
-                print(f"Decrypted {len(employees)} payroll employees for user: {username}")
-                return employees
-            elif os.path.exists(plain_file):
-                # Fallback to plain file if exists
-                with open(plain_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            else:
-                # Return empty list for new users
-                print(f"No payroll data found for user: {username}, returning empty list")
-                return []
+            try:
+                # Decrypt with the password-derived key (cached per password + salt);
+                # handles both the AES-GCM .bin file and the legacy base64 .encrypted file
+                decrypted_bytes, salt = encryption_service.decrypt_bytes(blob, password, self._associated_data(username))
+            except Exception as e:
+                raise PermissionError(f"Cannot decrypt payroll data for user {username}: wrong password or corrupt file") from e
+            self._user_salts[username] = salt
+            
+            if decrypted_bytes[:1] == _COMPRESSED_TAG:
+                decrypted_bytes = zlib.decompress(decrypted_bytes[1:])
+            
+            # Parse JSON straight from the UTF-8 bytes
+            employees = orjson.loads(decrypted_bytes)
+            id_index = self._build_id_index(employees)
+            with self._cache_lock:
+                self._cache[username] = (signature, tag, employees, id_index)
+            print(f"Decrypted {len(employees)} payroll employees for user: {username}")
+            return employees, id_index
+    
+    def _load_indexed(self, username: str, password: str) -> Tuple[List[Dict[str, Any]], Dict[Any, int]]:
+        """Like _read_indexed, but data that can't be read counts as no data (for reads only)"""
+        try:
+            return self._read_indexed(username, password)
         except Exception as e:
             print(f"Error loading payroll employees for {username}: {e}")
-            return []
+            return [], {}
+    
+    def _migrate_plain_file(self, username: str, password: str) -> Tuple[List[Dict[str, Any]], Dict[Any, int]]:
+        """
+        Encrypt a leftover plain payroll_{username}.json and delete it, so
+        later loads only ever read the encrypted file. Only done for the
+        account's real password (PermissionError otherwise): encrypting with
+        a wrong one would lock the data away for good once the plain file is gone.
+        """
+        _, plain_file = self._get_user_files(username)
+        if not os.path.exists(plain_file):
+            # Return empty list for new users
+            print(f"No payroll data found for user: {username}, returning empty list")
+            return [], {}
+        
+        if user_service.authenticate_user(username, password) is None:
+            raise PermissionError(f"Not migrating plain payroll data for {username}: invalid credentials")
+        
+        with open(plain_file, 'rb') as f:
+            employees = orjson.loads(f.read())
+        
+        if self.save_payroll_employees(username, password, employees):
+            os.remove(plain_file)
+            print(f"Migrated plain payroll data to encrypted storage for user: {username}")
+        return employees, self._build_id_index(employees)
+    
+    def load_payroll_employees(self, username: str, password: str) -> List[Dict[str, Any]]:
+        """Load payroll employee data for a specific user (decrypted)."""
+        employees, _ = self._load_indexed(username, password)
+        return self._copy_employees(employees)
     
     def save_payroll_employees(self, username: str, password: str, employees: List[Dict[str, Any]]) -> bool:
         """Save payroll employee data for a specific user (encrypted)."""
@@ -81,44 +178,37 @@ class PayrollService:
             print(f"Saving {len(employees)} payroll employees for user: {username}")
             encrypted_file, _ = self._get_user_files(username)
             
-            # Convert to JSON string
-            json_str = json.dumps(employees, ensure_ascii=False, indent=2)
-            
-            # Generate salt
-            import base64
-            salt = os.urandom(16)
-            
-            # Derive key from password
-            from cryptography.hazmat.primitives import hashes
-            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-            from cryptography.hazmat.backends import default_backend
-            from cryptography.fernet import Fernet
+            # Serialize to compact UTF-8 JSON bytes (the plaintext is never
+            # read by people, so indentation would only inflate the ciphertext)
+            json_bytes = orjson.dumps(employees, option=orjson.OPT_NON_STR_KEYS)
+            plaintext = _COMPRESSED_TAG + zlib.compress(json_bytes, _COMPRESSION_LEVEL)
             
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=salt,
-                iterations=100000,
-                backend=default_backend()
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+            # Reuse the user's salt so the cached key applies, else generate one
+            salt = self._user_salts.get(username) or os.urandom(SALT_SIZE)
             
-            # Create Fernet cipher
-            cipher = Fernet(key)
-            
-            # Encrypt data
-            encrypted_data = cipher.encrypt(json_str.encode('utf-8'))
-            
-            # Combine salt + encrypted data
-            combined = salt + encrypted_data
-            
-            # Encode to base64 for storage
-            encoded = base64.b64encode(combined).decode('utf-8')
-            
-            # Save encrypted file
-            with open(encrypted_file, 'w', encoding='utf-8') as f:
-                f.write(encoded)
+            # Encrypt with AES-GCM (same file layout as the employee data)
+            blob = encryption_service.encrypt_bytes(plaintext, password, salt, self._associated_data(username))
             
+            with self._user_lock(username):
+                # Save encrypted file as raw bytes, swapped in atomically so a
+                # crash mid-write never leaves a truncated file behind
+                atomic_write_bytes(encrypted_file, blob)
+                
+                # The legacy base64 file has now been superseded
+                legacy_file = self._get_legacy_file(username)
+                if os.path.exists(legacy_file):
+                    os.remove(legacy_file)
+                
+                self._user_salts[username] = salt
+                found = self._find_encrypted_file(username)
+                entry = None
+                if found is not None:
+                    entry = (found[1], self._password_tag(password), self._copy_employees(employees), self._build_id_index(employees))
+                with self._cache_lock:
+                    if entry is not None:
+                        self._cache[username] = entry
+                    else:
+                        self._cache.pop(username, None)
             print(f"Payroll data encrypted and saved successfully for user '{username}'")
             return True
             
@@ -128,42 +218,62 @@ class PayrollService:
     
     def get_payroll_employee_by_id(self, username: str, password: str, employee_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific payroll employee by ID for a user."""
-        employees = self.load_payroll_employees(username, password)
-        for employee in employees:
-            if employee.get("id") == employee_id:
-                return employee
-        return None
+        with self._user_lock(username):
+            employees, id_index = self._load_indexed(username, password)
+            idx = id_index.get(employee_id)
+            return dict(employees[idx]) if idx is not None else None
+    
+    def _modify_payroll_employees(
+        self,
+        username: str,
+        password: str,
+        modify: Callable[[List[Dict[str, Any]], Dict[Any, int]], Optional[List[Dict[str, Any]]]],
+    ) -> bool:
+        """
+        Load, modify and save a user's payroll employees as one step under the user's lock.
+        `modify` gets a copy of the list and its id -> position index, and
+        returns the new list, or None to leave the data unchanged.
+        Raises PermissionError (and saves nothing) if the existing data can't
+        be decrypted, so a wrong password never overwrites it.
+        """
+        with self._user_lock(username):
+            employees, id_index = self._read_indexed(username, password)
+            employees = modify(self._copy_employees(employees), id_index)
+            if employees is None:
+                return False
+            return self.save_payroll_employees(username, password, employees)
     
     def add_payroll_employee(self, username: str, password: str, employee_data: Dict[str, Any]) -> bool:
         """Add a new payroll employee for a user."""
-        employees = self.load_payroll_employees(username, password)
-        employees.append(employee_data)
-        return self.save_payroll_employees(username, password, employees)
+        return self._modify_payroll_employees(username, password, lambda employees, _: employees + [employee_data])
     
     def update_payroll_employee(self, username: str, password: str, employee_id: str, updated_data: Dict[str, Any]) -> bool:
         """Update an existing payroll employee for a user."""
-        employees = self.load_payroll_employees(username, password)
-        for i, employee in enumerate(employees):
-            if employee.get("id") == employee_id:
-                employees[i] = {**employee, **updated_data}
-                return self.save_payroll_employees(username, password, employees)
-        return False
+        def modify(employees, id_index):
+            idx = id_index.get(employee_id)
+            if idx is None:
+                return None
+            employees[idx] = {**employees[idx], **updated_data}
+            return employees
+        return self._modify_payroll_employees(username, password, modify)
     
     def delete_payroll_employee(self, username: str, password: str, employee_id: str) -> bool:
         """Delete a payroll employee by ID for a user."""
-        employees = self.load_payroll_employees(username, password)
-        initial_count = len(employees)
-        employees = [emp for emp in employees if emp.get("id") != employee_id]
-        if len(employees) < initial_count:
-            return self.save_payroll_employees(username, password, employees)
-        return False
+        def modify(employees, id_index):
+            if employee_id not in id_index:
+                return None
+            remaining = [emp for emp in employees if emp.get("id") != employee_id]
+            return remaining if len(remaining) < len(employees) else None
+        return self._modify_payroll_employees(username, password, modify)
     
     def clear_all_payroll_employees(self, username: str, password: str) -> int:
         """Clear all payroll employees for a user."""
-        employees = self.load_payroll_employees(username, password)
-        count = len(employees)
-        self.save_payroll_employees(username, password, [])
-        return count
+        cleared = []
+        def modify(employees, _):
+            cleared.append(len(employees))
+            return []
+        self._modify_payroll_employees(username, password, modify)
+        return cleared[0]
 
 # Create a singleton instance
 payroll_service = PayrollService()
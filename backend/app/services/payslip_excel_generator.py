@@ -4,136 +4,266 @@ Creates personalized pay slip Excel files using the Payslip_sample.xlsx template
 """
 import io
 import os
+import re
+import math
+import numbers
+import zipfile
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
-from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
+from typing import Any, Callable, Dict, List, Mapping, Union
+from xml.sax.saxutils import escape
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Path to the template file - relative to this file's location
+# This file is at: backend/app/services/payslip_excel_generator.py
+# Template is at: backend/templates/Payslip_sample.xlsx
+TEMPLATE_PATH = Path(__file__).parent.parent.parent / "templates" / "Payslip_sample.xlsx"
 
-def generate_payslip_excel(calculation_data: Dict[str, Any]) -> bytes:
+
+@lru_cache(maxsize=None)
+def _template_bytes() -> bytes:
+    """Read the template file once; later pay slips load it from memory."""
+    logger.info(f"Looking for template at: {TEMPLATE_PATH.absolute()}")
+    
+    if not TEMPLATE_PATH.exists():
+        logger.error(f"Template file not found at: {TEMPLATE_PATH.absolute()}")
+        # Try alternative paths for debugging
+        alt_path1 = Path(os.getcwd()) / "backend" / "templates" / "Payslip_sample.xlsx"
+        alt_path2 = Path(os.getcwd()) / "templates" / "Payslip_sample.xlsx"
+        logger.error(f"Alternative path 1 exists: {alt_path1.exists()} - {alt_path1.absolute()}")
+        logger.error(f"Alternative path 2 exists: {alt_path2.exists()} - {alt_path2.absolute()}")
+        raise FileNotFoundError(f"Template file not found: {TEMPLATE_PATH}")
+    
+    return TEMPLATE_PATH.read_bytes()
+
+
+# Cells filled straight from a calculation value: (cell, key)
+CELLS = [
+    ('D2', 'employeeNo'),  # employee ID
+    ('D3', 'name'),  # full name
+    ('D4', 'dependants'),  # dependants
+    ('D11', 'totalOTHours'),  # Total OT hours
+    ('G7', 'totalSalary'),  # A. Salary and Allowance (value only, preserve formatting)
+    ('I8', 'augSalary'),  # Day-work salary
+    ('I12', 'allowanceTax'),  # Allowance must pay PIT
+    ('I13', 'bonus'),  # Bonus
+    ('G24', 'totalSalary'),  # B. Total income (same as A. Salary and Allowance)
+    ('I33', 'personalRelief'),  # Personal relief
+    ('I34', 'dependentRelief'),  # Dependent relief
+    ('G36', 'employeeInsurance'),  # D. Insurance contribution
+    ('G37', 'unionFee'),  # Đoàn phí
+    ('G38', 'assessableIncome'),  # E. Assessable income
+    ('G40', 'personalIncomeTax'),  # F. Personal income tax
+    ('G41', 'advance'),  # Trừ Adv
+    ('G42', 'totalNetIncome'),  # net income
+]
+
+# Extra cells computed from several values
+_COMPUTED_CELLS = ['I11', 'G32', 'I2']
+
+# Defaults for values missing from the calculation data
+_DEFAULTS = {'employeeNo': '', 'name': ''}
+
+# Worksheet part inside the .xlsx ZIP that receives the values
+SHEET_PART = "xl/worksheets/sheet1.xml"
+_CALC_CHAIN_PART = "xl/calcChain.xml"
+
+_RE_CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+_RE_STYLE = re.compile(r' s="(\d+)"')
+_RE_CALC_PR = re.compile(r'<calcPr\b([^>]*?)\s*/>')
+_RE_CALC_CHAIN_OVERRIDE = re.compile(r'<Override PartName="/xl/calcChain\.xml"[^>]*/>')
+_RE_CALC_CHAIN_REL = re.compile(r'<Relationship [^>]*?Target="calcChain\.xml"[^>]*/>')
+
+
+def _column_key(ref: str) -> tuple:
+    """Sort key of a cell reference's column (B < Z < AA)."""
+    column = _RE_CELL_REF.fullmatch(ref).group(1)
+    return len(column), column
+
+
+def _cell_xml(ref: str, style: str, value: Any) -> str:
+    """Render one <c> element the way openpyxl writes it."""
+    attrs = f'r="{ref}" s="{style}"' if style else f'r="{ref}"'
+    if value is None or value == '':
+        return f'<c {attrs}/>'
+    if isinstance(value, bool):
+        return f'<c {attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Number):
+        # Same number formatting as openpyxl (integral floats lose the ".0")
+        text = "%.16g" % value if math.isfinite(value) else ""
+        return f'<c {attrs} t="n"><v>{text}</v></c>'
+    
+    text = str(value)
+    if ILLEGAL_CHARACTERS_RE.search(text):
+        raise ValueError(f"Cell {ref} contains characters not allowed in Excel: {text!r}")
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c {attrs} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+
+class _PayslipTemplate:
     """
-    Generate a personalized pay slip Excel file using the template.
+    The template .xlsx split into what never changes and the cells filled per pay slip.
     
-    Args:
-        calculation_data: Dictionary containing all the calculation values from frontend
-        
-    Returns:
-        Bytes content of the Excel file
+    Every part except the worksheet is written once into a ZIP prefix; a pay
+    slip appends its worksheet to a copy of that prefix, so the template is
+    never re-parsed and only the worksheet XML is compressed per pay slip.
     """
-    try:
-        logger.info(f"Starting payslip generation for employee: {calculation_data.get('name', 'Unknown')}")
+    
+    def __init__(self, template: bytes):
+        parts = {}
+        with zipfile.ZipFile(io.BytesIO(template)) as zin:
+            for info in zin.infolist():
+                parts[info.filename] = zin.read(info)
         
-        # Path to the template file - relative to this file's location
-        # This file is at: backend/app/services/payslip_excel_generator.py
-        # Template is at: backend/templates/Payslip_sample.xlsx
-        current_file_dir = Path(__file__).parent  # app/services/
-        backend_dir = current_file_dir.parent.parent  # backend/
-        template_path = backend_dir / "templates" / "Payslip_sample.xlsx"
+        sheet_xml = parts.pop(SHEET_PART).decode("utf-8")
+        refs = list(dict.fromkeys([ref for ref, _ in CELLS] + _COMPUTED_CELLS))
+        self._refs: List[str] = []
+        self._styles: Dict[str, str] = {}
+        self._static = self._split_sheet(sheet_xml, refs)
         
-        logger.info(f"Current file directory: {current_file_dir}")
-        logger.info(f"Backend directory: {backend_dir}")
-        logger.info(f"Looking for template at: {template_path.absolute()}")
+        # Overwritten formula cells would leave the calculation chain stale;
+        # drop it (Excel rebuilds it) and recalculate on open, as openpyxl does
+        if parts.pop(_CALC_CHAIN_PART, None) is not None:
+            parts["[Content_Types].xml"] = _RE_CALC_CHAIN_OVERRIDE.sub(
+                "", parts["[Content_Types].xml"].decode("utf-8")).encode("utf-8")
+            parts["xl/_rels/workbook.xml.rels"] = _RE_CALC_CHAIN_REL.sub(
+                "", parts["xl/_rels/workbook.xml.rels"].decode("utf-8")).encode("utf-8")
+        workbook_xml = parts["xl/workbook.xml"].decode("utf-8")
+        if 'fullCalcOnLoad=' not in workbook_xml:
+            workbook_xml = _RE_CALC_PR.sub(r'<calcPr\1 fullCalcOnLoad="1"/>', workbook_xml, count=1)
+        parts["xl/workbook.xml"] = workbook_xml.encode("utf-8")
         
-        if not template_path.exists():
-            logger.error(f"Template file not found at: {template_path.absolute()}")
-            # Try alternative paths for debugging
-            alt_path1 = Path(os.getcwd()) / "backend" / "templates" / "Payslip_sample.xlsx"
-            alt_path2 = Path(os.getcwd()) / "templates" / "Payslip_sample.xlsx"
-            logger.error(f"Alternative path 1 exists: {alt_path1.exists()} - {alt_path1.absolute()}")
-            logger.error(f"Alternative path 2 exists: {alt_path2.exists()} - {alt_path2.absolute()}")
-            raise FileNotFoundError(f"Template file not found: {template_path}")
+        prefix = io.BytesIO()
+        with zipfile.ZipFile(prefix, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for name, data in parts.items():
+                zout.writestr(name, data)
+        self._prefix = prefix.getvalue()
+    
+    def _split_sheet(self, sheet_xml: str, refs: List[str]) -> List[str]:
+        """
+        Cut the target cells out of the worksheet XML, returning the static
+        text around them (one more piece than refs), and record their styles.
+        Cells missing from the template are inserted into their row.
+        """
+        spans = []
+        for ref in refs:
+            match = re.search(rf'<c r="{ref}"(?:\s[^>]*?)?(?:/>|>.*?</c>)', sheet_xml, re.S)
+            if match:
+                style = _RE_STYLE.search(match.group(0)[:match.group(0).index('>')])
+                self._styles[ref] = style.group(1) if style else ''
+                spans.append((match.start(), match.end(), ref))
+                continue
             
-        logger.info("Template file found, loading workbook...")
-    except Exception as e:
-        logger.error(f"Error in payslip generation setup: {str(e)}")
-        raise
+            # Not in the template: insert before the first cell to its right
+            row = _RE_CELL_REF.fullmatch(ref).group(2)
+            row_match = re.search(rf'<row r="{row}"[^>]*?(?:/>|>(.*?)</row>)', sheet_xml, re.S)
+            if row_match is None or row_match.group(1) is None:
+                raise ValueError(f"Template row {row} for cell {ref} not found")
+            position = row_match.end(1)
+            for cell in re.finditer(r'<c r="([A-Z]+\d+)"', row_match.group(1)):
+                if _column_key(cell.group(1)) > _column_key(ref):
+                    position = row_match.start(1) + cell.start()
+                    break
+            self._styles[ref] = ''
+            spans.append((position, position, ref))
+        
+        spans.sort()
+        self._refs = [ref for _, _, ref in spans]
+        static, last = [], 0
+        for start, end, _ in spans:
+            static.append(sheet_xml[last:start])
+            last = end
+        static.append(sheet_xml[last:])
+        return static
     
-    # Load the template workbook
+    def render(self, values: Dict[str, Any]) -> bytes:
+        """Build the .xlsx bytes with the given {cell: value} filled in."""
+        pieces = [self._static[0]]
+        for ref, static in zip(self._refs, self._static[1:]):
+            pieces.append(_cell_xml(ref, self._styles[ref], values[ref]))
+            pieces.append(static)
+        
+        output_buffer = io.BytesIO(self._prefix)
+        output_buffer.seek(0, io.SEEK_END)
+        with zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED) as zout:
+            zout.writestr(SHEET_PART, "".join(pieces).encode("utf-8"))
+        return output_buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def _payslip_template() -> _PayslipTemplate:
+    """Split the template once; later pay slips only fill in cell values."""
     try:
-        workbook = load_workbook(template_path)
-        worksheet: Worksheet = workbook.active
+        return _PayslipTemplate(_template_bytes())
     except Exception as e:
-        logger.error(f"Failed to load workbook: {str(e)}")
+        logger.error(f"Failed to load template: {str(e)}")
         raise
+
+
+def _getter(calculation_data: Union[Dict[str, Any], Any]) -> Callable[[str], Any]:
+    """Value lookup for a dict or an object exposing the values as attributes."""
+    if isinstance(calculation_data, Mapping):
+        return lambda key: calculation_data.get(key, _DEFAULTS.get(key, 0))
+    return lambda key: getattr(calculation_data, key, _DEFAULTS.get(key, 0))
+
+
+def _render_payslip(template: _PayslipTemplate, calculation_data: Union[Dict[str, Any], Any]) -> bytes:
+    """
+    Fill the template's cells for one employee and return the file bytes.
+    Only cell values change, so the template's formatting is untouched.
+    """
+    get = _getter(calculation_data)
+    logger.info(f"Starting payslip generation for employee: {get('name') or 'Unknown'}")
+    values = {cell: get(key) for cell, key in CELLS}
     
-    # Extract values from calculation data with defaults
-    employee_no = calculation_data.get('employeeNo', '')
-    name = calculation_data.get('name', '')
-    dependants = calculation_data.get('dependants', 0)
-    aug_salary = calculation_data.get('augSalary', 0)  # Day-work salary
-    total_salary = calculation_data.get('totalSalary', 0)  # A. Salary and Allowance
-    allowance_tax = calculation_data.get('allowanceTax', 0)  # Allowance must pay PIT
-    bonus = calculation_data.get('bonus', 0)
-    personal_relief = calculation_data.get('personalRelief', 0)
-    dependent_relief = calculation_data.get('dependentRelief', 0)
-    employee_insurance = calculation_data.get('employeeInsurance', 0)  # D. Insurance contribution
-    union_fee = calculation_data.get('unionFee', 0)  # Đoàn phí
-    assessable_income = calculation_data.get('assessableIncome', 0)  # E. Assessable income
-    personal_income_tax = calculation_data.get('personalIncomeTax', 0)  # F. Personal income tax
-    advance = calculation_data.get('advance', 0)  # Trừ Adv
-    total_net_income = calculation_data.get('totalNetIncome', 0)  # Net income
-    total_ot_hours = calculation_data.get('totalOTHours', 0)  # Total OT hours
-    
-    # Calculate overtime pay (combined): OT none pay PIT + OT pay PIT
-    overtime_pay_pit = calculation_data.get('overtimePayPIT', 0)  # OT pay PIT
-    overtime_pay_non_pit = calculation_data.get('overtimePayNonPIT', 0)  # OT none pay PIT
-    combined_overtime_pay = overtime_pay_non_pit + overtime_pay_pit  # Over Time = OT none pay PIT + OT pay PIT
-    
-    # Calculate tax deductions (C. Tax deductions)
-    tax_deductions = personal_relief + dependent_relief
-    
-    # Fill in the Excel cells with values (preserving formatting)
-    # Based on the mapping provided by the user
-    
-    # Employee information
-    worksheet['D2'] = employee_no  # employee ID
-    worksheet['D3'] = name  # full name
-    worksheet['D4'] = dependants  # dependants
-    worksheet['D11'] = total_ot_hours  # Total OT hours
+    # Over Time = OT none pay PIT + OT pay PIT (G11 is intentionally left empty)
+    values['I11'] = get('overtimePayNonPIT') + get('overtimePayPIT')
+    # C. Tax deductions = Personal relief + Dependent relief
+    values['G32'] = get('personalRelief') + get('dependentRelief')
     
     # Date information - using the same format as PaySlip component
     # JavaScript equivalent: currentDate.toLocaleDateString('en-US', { month: 'short', year: '2-digit' }).replace(' ', '-')
-    current_date = datetime.now()
-    month_year = current_date.strftime("%b-%y")  # Sep-25 format, same as PaySlip
-    worksheet['I2'] = month_year  # Current month-year (same format as PaySlip display)
+    values['I2'] = datetime.now().strftime("%b-%y")  # Sep-25 format, same as PaySlip
     
-    # Income section
-    worksheet['G7'] = total_salary  # A. Salary and Allowance (value only, preserve formatting)
-    worksheet['I8'] = aug_salary  # Day-work salary
-    # G11 - Do not fill any values (as requested)
-    worksheet['I11'] = combined_overtime_pay  # Over Time (OT none pay PIT + OT pay PIT)
-    worksheet['I12'] = allowance_tax  # Allowance must pay PIT
-    worksheet['I13'] = bonus  # Bonus
-    worksheet['G24'] = total_salary  # B. Total income (same as A. Salary and Allowance)
-    
-    # Tax deductions section
-    worksheet['G32'] = tax_deductions  # C. Tax deductions
-    worksheet['I33'] = personal_relief  # Personal relief
-    worksheet['I34'] = dependent_relief  # Dependent relief
-    
-    # Insurance and deductions
-    worksheet['G36'] = employee_insurance  # D. Insurance contribution
-    worksheet['G37'] = union_fee  # Đoàn phí
-    worksheet['G38'] = assessable_income  # E. Assessable income
-    worksheet['G40'] = personal_income_tax  # F. Personal income tax
-    worksheet['G41'] = advance  # Trừ Adv
-    worksheet['G42'] = total_net_income  # net income
-    
-    # Save to bytes buffer
-    logger.info("Saving workbook to bytes buffer...")
     try:
-        output_buffer = io.BytesIO()
-        workbook.save(output_buffer)
-        output_buffer.seek(0)
-        
-        result_bytes = output_buffer.getvalue()
+        result_bytes = template.render(values)
         logger.info(f"Generated Excel file successfully, size: {len(result_bytes)} bytes")
-        
         return result_bytes
     except Exception as e:
         logger.error(f"Failed to save workbook: {str(e)}")
         raise
+
+
+def generate_payslip_excel(calculation_data: Union[Dict[str, Any], Any]) -> bytes:
+    """
+    Generate a personalized pay slip Excel file using the template.
+    
+    The template is split once; each pay slip only writes its cell values
+    into the worksheet XML, without loading the workbook through openpyxl.
+    
+    Args:
+        calculation_data: Dictionary containing all the calculation values from frontend,
+            or an object exposing them as attributes (e.g. a batch SalaryRow)
+        
+    Returns:
+        Bytes content of the Excel file
+    """
+    return _render_payslip(_payslip_template(), calculation_data)
+
+
+def generate_payslips_batch(data_list: List[Union[Dict[str, Any], Any]]) -> List[bytes]:
+    """
+    Generate pay slip Excel files for many employees from a single template.
+    
+    Args:
+        data_list: Calculation values per employee (see generate_payslip_excel)
+        
+    Returns:
+        Bytes content of each Excel file, in input order
+    """
+    template = _payslip_template()
+    return [_render_payslip(template, calculation_data) for calculation_data in data_list]
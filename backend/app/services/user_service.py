@@ -2,13 +2,36 @@
 User account management service for authentication and password recovery
 """
 import os
-import json
+import hmac
 import hashlib
 import base64
-from typing import Optional, Dict, Any, List
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
+import orjson
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .encryption_service import encryption_service
+from .file_utils import atomic_write_bytes
+
+
+# PBKDF2-HMAC-SHA256 work factor for login passwords (same as encryption service)
+PASSWORD_HASH_ITERATIONS = 100_000
+
+# Seconds a successful login is remembered; repeat logins within this window
+# are checked against a fast keyed hash instead of re-running PBKDF2
+VERIFY_CACHE_TTL = 300
+
+# Encrypted PII fields are base64 of: version (1) | nonce (12) | AES-GCM ciphertext + tag.
+# Older fields are base64 of a Fernet token, whose raw bytes start with "g".
+FIELD_FORMAT_VERSION = b"\x01"
+FIELD_NONCE_SIZE = 12
+
+# Decrypted PII fields kept in memory, keyed by their stored value
+FIELD_CACHE_SIZE = 1024
 
 
 class UserService:
@@ -21,7 +44,23 @@ class UserService:
         # System-level encryption key for username/email (not user-specific)
         # In production, this should be in environment variable
         self.system_key = self._get_or_create_system_key()
-        self.cipher = Fernet(self.system_key)
+        self.aead = AESGCM(hashlib.sha256(self.system_key).digest())
+        # A stored field always decrypts to the same value, so repeat lookups of
+        # the same accounts skip the base64 decode and AES-GCM call
+        self._decrypt_stored_field = lru_cache(maxsize=FIELD_CACHE_SIZE)(self._decrypt_field)
+        
+        # {username: (keyed BLAKE2b of the password, stored password hash, time)}.
+        # Only kept in memory; an entry stops matching once the stored hash
+        # changes (password reset) or the TTL runs out.
+        self._verify_cache: Dict[str, Tuple[bytes, str, float]] = {}
+        self._verify_key = hashlib.blake2b(self.system_key, digest_size=32, person=b"verify-cache").digest()
+        self._token_key = hashlib.blake2b(self.system_key, digest_size=32, person=b"pii-lookup").digest()
+        
+        # (file signature, stored users, username index, email index); the
+        # signature is the (mtime_ns, size) of the file it was read from, and the
+        # entry is reused until the accounts file changes on disk
+        self._users_cache: Optional[Tuple[Tuple[int, int], List[Dict[str, Any]], Dict[str, int], Dict[str, int]]] = None
+        self._users_lock = threading.Lock()
     
     def _get_or_create_system_key(self) -> bytes:
         """Get or create system-level encryption key"""
@@ -42,16 +81,26 @@ class UserService:
                 pass  # Windows may not support chmod
             return key
     
+    @cached_property
+    def cipher(self) -> Fernet:
+        """Fernet cipher for legacy fields, built the first time one is read"""
+        return Fernet(self.system_key)
+    
     def _encrypt_field(self, value: str) -> str:
         """Encrypt a field value for storage"""
-        encrypted = self.cipher.encrypt(value.encode('utf-8'))
-        return base64.b64encode(encrypted).decode('utf-8')
+        nonce = os.urandom(FIELD_NONCE_SIZE)
+        encrypted = self.aead.encrypt(nonce, value.encode('utf-8'), None)
+        return base64.b64encode(FIELD_FORMAT_VERSION + nonce + encrypted).decode('utf-8')
     
     def _decrypt_field(self, encrypted_value: str) -> str:
-        """Decrypt a field value from storage"""
+        """Decrypt a field value from storage (AES-GCM, or a legacy Fernet token)"""
         try:
             encrypted_bytes = base64.b64decode(encrypted_value)
-            decrypted = self.cipher.decrypt(encrypted_bytes)
+            if encrypted_bytes[:1] == FIELD_FORMAT_VERSION:
+                nonce_end = 1 + FIELD_NONCE_SIZE
+                decrypted = self.aead.decrypt(encrypted_bytes[1:nonce_end], encrypted_bytes[nonce_end:], None)
+            else:
+                decrypted = self.cipher.decrypt(encrypted_bytes)
             return decrypted.decode('utf-8')
         except Exception as e:
             print(f"Error decrypting field: {e}")
@@ -65,13 +114,7 @@ class UserService:
         if salt is None:
             salt = os.urandom(32)  # 32 bytes salt
         
-        # Use PBKDF2 with 100,000 iterations (same as encryption service)
-        pwd_hash = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000  # iterations
-        )
+        pwd_hash = self._derive_password_hash(password, salt)
         
         # Return base64 encoded strings for JSON storage
         return (
@@ -79,42 +122,138 @@ class UserService:
             base64.b64encode(salt).decode('utf-8')
         )
     
+    @staticmethod
+    def _derive_password_hash(password: str, salt: bytes) -> bytes:
+        """Raw PBKDF2-HMAC-SHA256 digest of password (OpenSSL does the iterations)"""
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PASSWORD_HASH_ITERATIONS)
+    
     def _verify_password(self, password: str, hashed_password: str, salt: str) -> bool:
         """
         Verify password against stored hash
         """
         try:
-            # Decode salt from base64
+            # Decode hash and salt from base64
             salt_bytes = base64.b64decode(salt)
+            stored_hash = base64.b64decode(hashed_password)
             
             # Hash the provided password with the stored salt
-            new_hash, _ = self._hash_password(password, salt_bytes)
+            new_hash = self._derive_password_hash(password, salt_bytes)
             
-            # Compare hashes
-            return new_hash == hashed_password
+            # Compare raw digests in constant time (== stops at the first
+            # differing byte and leaks how much of the hash matched)
+            return hmac.compare_digest(new_hash, stored_hash)
         except Exception as e:
             print(f"Error verifying password: {e}")
             return False
     
+    def _check_user_password(self, user: Dict[str, Any], password: str) -> bool:
+        """
+        Verify a hashed-password user's login, skipping PBKDF2 when the same
+        password was verified for this user within VERIFY_CACHE_TTL
+        """
+        username = user['username']
+        fast_hash = hashlib.blake2b(password.encode('utf-8'), key=self._verify_key, digest_size=16).digest()
+        
+        cached = self._verify_cache.get(username)
+        if (cached is not None
+                and cached[1] == user['password_hash']
+                and time.monotonic() - cached[2] < VERIFY_CACHE_TTL
+                and hmac.compare_digest(cached[0], fast_hash)):
+            return True
+        
+        if self._verify_password(password, user['password_hash'], user['password_salt']):
+            self._verify_cache[username] = (fast_hash, user['password_hash'], time.monotonic())
+            return True
+        return False
+    
+    def _lookup_token(self, value: str) -> str:
+        """
+        Keyed hash of a username or email, stored next to the encrypted field
+        so accounts can be found without decrypting every user
+        """
+        return hashlib.blake2b(value.encode('utf-8'), key=self._token_key, digest_size=16).hexdigest()
+    
+    def _with_pii(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a stored user with username and email decrypted"""
+        user = user.copy()
+        if 'username' not in user and 'username_encrypted' in user:
+            user['username'] = self._decrypt_stored_field(user['username_encrypted'])
+        if 'email' not in user and 'email_encrypted' in user:
+            user['email'] = self._decrypt_stored_field(user['email_encrypted'])
+        return user
+    
+    def _read_users_file(self) -> List[Dict[str, Any]]:
+        """Read user_accounts.json as stored (username and email still encrypted)"""
+        with open(self.users_file, 'rb') as f:
+            return orjson.loads(f.read())
+    
+    def _cached_users(self) -> Tuple[List[Dict[str, Any]], Dict[str, int], Dict[str, int]]:
+        """
+        Stored users with username-token -> position and email-token -> position
+        indexes (first match wins, as with a scan). These are the cached objects
+        themselves: read them, never modify them.
+        """
+        try:
+            st = os.stat(self.users_file)
+        except FileNotFoundError:
+            return [], {}, {}
+        signature = (st.st_mtime_ns, st.st_size)
+        
+        with self._users_lock:
+            cached = self._users_cache
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2], cached[3]
+        
+        try:
+            users = self._read_users_file()
+        except Exception as e:
+            print(f"Error loading users: {e}")
+            return [], {}, {}
+        
+        by_username: Dict[str, int] = {}
+        by_email: Dict[str, int] = {}
+        for i, user in enumerate(users):
+            if 'username_token' not in user or 'email_token' not in user:
+                # Saved before lookup tokens existed: decrypt once. The plaintext
+                # fields also make the next save store the tokens.
+                user.update(self._with_pii(user))
+                username_token = self._lookup_token(user.get('username', ''))
+                email_token = self._lookup_token(user.get('email', ''))
+            else:
+                username_token = user['username_token']
+                email_token = user['email_token']
+            by_username.setdefault(username_token, i)
+            by_email.setdefault(email_token, i)
+        
+        with self._users_lock:
+            self._users_cache = (signature, users, by_username, by_email)
+        return users, by_username, by_email
+    
+    def _find_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """Account for username with username and email decrypted, or None"""
+        users, by_username, _ = self._cached_users()
+        i = by_username.get(self._lookup_token(username))
+        if i is None:
+            return None
+        user = self._with_pii(users[i])
+        # Guards against token collisions; compared in constant time like the passwords
+        if hmac.compare_digest(user.get('username', '').encode('utf-8'), username.encode('utf-8')):
+            return user
+        return None
+    
     def _load_users(self, decrypt_pii: bool = True) -> List[Dict[str, Any]]:
         """
         Load all user accounts
         If decrypt_pii=True, decrypts username and email for use in code
         """
+        if decrypt_pii:
+            # Callers modify the returned dicts, so hand out copies
+            users, _, _ = self._cached_users()
+            return [self._with_pii(user) for user in users]
+        
         try:
             if os.path.exists(self.users_file):
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    users = json.load(f)
-                
-                if decrypt_pii:
-                    # Decrypt username and email for each user
-                    for user in users:
-                        if 'username_encrypted' in user:
-                            user['username'] = self._decrypt_field(user['username_encrypted'])
-                        if 'email_encrypted' in user:
-                            user['email'] = self._decrypt_field(user['email_encrypted'])
-                
-                return users
+                return self._read_users_file()
             return []
         except Exception as e:
             print(f"Error loading users: {e}")
@@ -135,17 +274,24 @@ class UserService:
                 # Encrypt username if present
                 if 'username' in user_copy:
                     user_copy['username_encrypted'] = self._encrypt_field(user_copy['username'])
+                    user_copy['username_token'] = self._lookup_token(user_copy['username'])
                     del user_copy['username']  # Remove plain text
                 
                 # Encrypt email if present
                 if 'email' in user_copy:
                     user_copy['email_encrypted'] = self._encrypt_field(user_copy['email'])
+                    user_copy['email_token'] = self._lookup_token(user_copy['email'])
                     del user_copy['email']  # Remove plain text
                 
                 users_to_save.append(user_copy)
             
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(users_to_save, f, ensure_ascii=False, indent=2)
+            with self._users_lock:
+                self._users_cache = None
+            # Swapped in atomically: a crash mid-write must not lose every account
+            atomic_write_bytes(
+                self.users_file,
+                orjson.dumps(users_to_save, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS),
+            )
             return True
         except Exception as e:
             print(f"Error saving users: {e}")
@@ -156,10 +302,10 @@ class UserService:
         Register a new user with hashed password
         Returns: {"success": bool, "message": str, "user": dict}
         """
-        users = self._load_users()
+        users, by_username, by_email = self._cached_users()
         
         # Check if username already exists
-        if any(u['username'] == username for u in users):
+        if self._lookup_token(username) in by_username:
             return {
                 "success": False,
                 "message": "Username already exists",
@@ -167,7 +313,7 @@ class UserService:
             }
         
         # Check if email already exists
-        if any(u['email'] == email for u in users):
+        if self._lookup_token(email) in by_email:
             return {
                 "success": False,
                 "message": "Email already registered",
@@ -193,9 +339,8 @@ class UserService:
         if 'password' in new_user:
             del new_user['password']
         
-        users.append(new_user)
-        
-        if self._save_users(users):
+        # The cached list is shared, so save a new list rather than appending
+        if self._save_users(users + [new_user]):
             # Initialize empty encrypted database for new user
             try:
                 encryption_service.encrypt_data(username, password, data=[])
@@ -227,26 +372,14 @@ class UserService:
         Supports both hashed passwords (new) and plain text (legacy, for migration)
         Returns user info if successful, None otherwise
         """
-        users = self._load_users()
+        user = self._find_user(username)
+        if user is None:
+            return None
         
-        for user in users:
-            if user['username'] != username:
-                continue
-            
-            # Check if user has hashed password (new format)
-            if 'password_hash' in user and 'password_salt' in user:
-                # Verify hashed password
-                if self._verify_password(password, user['password_hash'], user['password_salt']):
-                    return {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "email": user["email"],
-                        "fullName": user["fullName"],
-                        "role": user.get("role", "User")
-                    }
-            # Legacy: Check plain text password (for backward compatibility)
-            elif 'password' in user and user['password'] == password:
-                print(f"⚠️ Warning: User '{username}' still using plain text password. Consider migrating.")
+        # Check if user has hashed password (new format)
+        if 'password_hash' in user and 'password_salt' in user:
+            # Verify hashed password
+            if self._check_user_password(user, password):
                 return {
                     "id": user["id"],
                     "username": user["username"],
@@ -254,6 +387,16 @@ class UserService:
                     "fullName": user["fullName"],
                     "role": user.get("role", "User")
                 }
+        # Legacy: Check plain text password (for backward compatibility)
+        elif 'password' in user and hmac.compare_digest(user['password'].encode('utf-8'), password.encode('utf-8')):
+            print(f"⚠️ Warning: User '{username}' still using plain text password. Consider migrating.")
+            return {
+                "id": user["id"],
+                "username": user["username"],
+                "email": user["email"],
+                "fullName": user["fullName"],
+                "role": user.get("role", "User")
+            }
         
         return None
     
@@ -264,36 +407,40 @@ class UserService:
         For hashed passwords, this returns a message that password recovery is not available.
         Returns: {"success": bool, "message": str, "credentials": dict}
         """
-        users = self._load_users()
+        user = self._find_user(username)
         
-        for user in users:
-            if user['email'] == email and user['username'] == username:
-                # Check if user has hashed password (new format)
-                if 'password_hash' in user:
-                    return {
-                        "success": True,
-                        "message": "Account found. Your password is securely hashed and cannot be recovered. Please contact your administrator for password reset.",
-                        "credentials": {
-                            "username": user["username"],
-                            "password": "***HASHED***",  # Cannot show hashed password
-                            "email": user["email"],
-                            "fullName": user["fullName"],
-                            "note": "Password is securely hashed and cannot be displayed"
-                        }
+        # Compare the email in constant time, and compare it even when no
+        # account matched, so the response time doesn't tell the two apart
+        stored_email = user.get('email', '') if user is not None else ''
+        email_ok = hmac.compare_digest(stored_email.encode('utf-8'), email.encode('utf-8'))
+        
+        if user is not None and email_ok:
+            # Check if user has hashed password (new format)
+            if 'password_hash' in user:
+                return {
+                    "success": True,
+                    "message": "Account found. Your password is securely hashed and cannot be recovered. Please contact your administrator for password reset.",
+                    "credentials": {
+                        "username": user["username"],
+                        "password": "***HASHED***",  # Cannot show hashed password
+                        "email": user["email"],
+                        "fullName": user["fullName"],
+                        "note": "Password is securely hashed and cannot be displayed"
                     }
-                # Legacy: Return plain text password if still stored (for migration period)
-                elif 'password' in user:
-                    print(f"⚠️ Warning: Returning plain text password for '{username}'. Migrate this user!")
-                    return {
-                        "success": True,
-                        "message": "Account found",
-                        "credentials": {
-                            "username": user["username"],
-                            "password": user["password"],
-                            "email": user["email"],
-                            "fullName": user["fullName"]
-                        }
+                }
+            # Legacy: Return plain text password if still stored (for migration period)
+            elif 'password' in user:
+                print(f"⚠️ Warning: Returning plain text password for '{username}'. Migrate this user!")
+                return {
+                    "success": True,
+                    "message": "Account found",
+                    "credentials": {
+                        "username": user["username"],
+                        "password": user["password"],
+                        "email": user["email"],
+                        "fullName": user["fullName"]
                     }
+                }
         
         return {
             "success": False,
@@ -303,52 +450,57 @@ class UserService:
     
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user information by username"""
-        users = self._load_users()
+        user = self._find_user(username)
+        if user is None:
+            return None
         
-        for user in users:
-            if user['username'] == username:
-                return {
-                    "id": user["id"],
-                    "username": user["username"],
-                    "email": user["email"],
-                    "fullName": user["fullName"],
-                    "role": user.get("role", "User")
-                }
-        
-        return None
+        return {
+            "id": user["id"],
+            "username": user["username"],
+            "email": user["email"],
+            "fullName": user["fullName"],
+            "role": user.get("role", "User")
+        }
     
     def reset_user_password(self, username: str, new_password: str) -> Dict[str, Any]:
         """
         Reset a user's password (admin function)
         Returns: {"success": bool, "message": str}
         """
-        users = self._load_users()
+        users, by_username, _ = self._cached_users()
+        i = by_username.get(self._lookup_token(username))
         
-        for user in users:
-            if user['username'] == username:
-                # Hash the new password
-                hashed_password, salt = self._hash_password(new_password)
-                
-                # Update user with new hashed password
-                user['password_hash'] = hashed_password
-                user['password_salt'] = salt
-                
-                # Remove old password field if it exists
-                if 'password' in user:
-                    del user['password']
-                
-                if self._save_users(users):
-                    print(f"[OK] Password reset for user: {username}")
-                    return {
-                        "success": True,
-                        "message": f"Password successfully reset for user '{username}'",
-                        "username": username
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "message": "Failed to save updated password"
-                    }
+        if i is not None:
+            # Work on copies; the cached dicts are shared
+            users = [user.copy() for user in users]
+            user = users[i]
+            
+            # Hash the new password
+            hashed_password, salt = self._hash_password(new_password)
+            
+            # Update user with new hashed password
+            user['password_hash'] = hashed_password
+            user['password_salt'] = salt
+            
+            # Remove old password field if it exists
+            if 'password' in user:
+                del user['password']
+            
+            # The old password must not keep working from the cache
+            self._verify_cache.pop(username, None)
+            
+            if self._save_users(users):
+                print(f"[OK] Password reset for user: {username}")
+                return {
+                    "success": True,
+                    "message": f"Password successfully reset for user '{username}'",
+                    "username": username
+                }
+            else:
+                return {
+                    "success": False,
+                    "message": "Failed to save updated password"
+                }
         
         return {
             "success": False,
@@ -379,16 +531,18 @@ class UserService:
         Returns: {"success": bool, "message": str, "migrated_count": int}
         """
         users = self._load_users(decrypt_pii=True)  # Load with decrypted PII
+        
+        # Users still holding a plain text password
+        legacy_users = [user for user in users if 'password' in user and 'password_hash' not in user]
         migrated_count = 0
         
-        for user in users:
-            # Check if user still has plain text password
-            if 'password' in user and 'password_hash' not in user:
-                plain_password = user['password']
-                
-                # Hash the password
-                hashed_password, salt = self._hash_password(plain_password)
-                
+        # PBKDF2 runs in OpenSSL with the GIL released, so the hashes are
+        # computed concurrently across cores
+        max_workers = min(len(legacy_users), os.cpu_count() or 1) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            hashes = executor.map(self._hash_password, [user['password'] for user in legacy_users])
+            
+            for user, (hashed_password, salt) in zip(legacy_users, hashes):
                 # Update user with hashed password
                 user['password_hash'] = hashed_password
                 user['password_salt'] = salt
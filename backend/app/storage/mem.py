@@ -5,20 +5,137 @@ Replicates the functionality of TypeScript MemStorage from server/storage.ts
 import uuid
 import json
 import os
+from functools import lru_cache
 from typing import Dict, List, Optional
 from datetime import datetime
 
+import numpy as np
+
 from ..models.schemas import (
     InsertEmployee,
     SelectEmployee,
     EmployeeUpdate,
     SalaryResult
 )
+from ..services.calculator import TAX_LIMITS, TAX_RATES, TAX_DEDUCTIONS
+
+
+# Input fields of the sample employees, in array row order
+_PAYROLL_INPUTS = ("salary", "bonus", "allowanceTax", "ot15", "ot20", "ot30", "dependants", "advance")
+
+# Tax brackets as arrays for np.searchsorted
+_TAX_LIMITS = np.array(TAX_LIMITS, dtype=np.float64)
+_TAX_RATES = np.array(TAX_RATES, dtype=np.float64)
+_TAX_DEDUCTIONS = np.array(TAX_DEDUCTIONS, dtype=np.float64)
+
+
+def _compute_payroll(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Derived payroll values for many employees in one vectorized pass.
+    
+    np.rint rounds half to even and np.trunc drops the fraction, the same as
+    the round() and int() calls of the former per-employee loop.
+    
+    Args:
+        values: float64 matrix with one row per _PAYROLL_INPUTS field and
+            one column per employee
+        
+    Returns:
+        Calculated SelectEmployee fields, each an array over the employees
+    """
+    salary, bonus, allowance_tax, ot15, ot20, ot30, dependants, advance = values
+    
+    # Calculate derived values
+    aug_salary = np.rint((salary / 21) * 20)
+    ot_rate = aug_salary / 176  # Hourly overtime base (22 days x 8 hours)
+    overtime_pay_pit = np.trunc(ot_rate * (ot15 + ot20 + ot30))
+    total_salary = np.rint(aug_salary + bonus + allowance_tax + overtime_pay_pit)
+    
+    personal_relief = np.full_like(salary, 11000000)
+    dependent_relief = 4400000 * dependants
+    company_insurance = salary * 0.215  # Company pays 21.5%
+    employee_insurance = salary * 0.105
+    union_fee = np.minimum(salary * 0.005, 234000)
+    
+    he_so = ot15 * 0.5 + ot20 + ot30 * 2
+    overtime_pay_non_pit = np.rint(ot_rate * he_so)
+    
+    assessable_income = np.maximum(0, total_salary - (employee_insurance + personal_relief + dependent_relief))
+    
+    # Calculate progressive tax (first bracket whose limit >= assessable income)
+    bracket = np.searchsorted(_TAX_LIMITS, assessable_income, side="left")
+    personal_income_tax = np.rint(np.maximum(assessable_income * _TAX_RATES[bracket] - _TAX_DEDUCTIONS[bracket], 0))
+    
+    # Calculate total OT hours (matching the form's calculation)
+    total_ot_hours = np.rint(ot15 + ot20 + ot30 + he_so)
+    
+    total_net_income = np.rint(total_salary - personal_income_tax - employee_insurance -
+                               union_fee + overtime_pay_non_pit - advance)
+    
+    return {
+        "augSalary": aug_salary,
+        "totalOTHours": total_ot_hours,
+        "totalNetIncome": total_net_income,
+        "overtimePayPIT": overtime_pay_pit,
+        "totalSalary": total_salary,
+        "personalRelief": personal_relief,
+        "dependentRelief": dependent_relief,
+        "assessableIncome": assessable_income,
+        "personalIncomeTax": personal_income_tax,
+        "companyInsurance": company_insurance,
+        "employeeInsurance": employee_insurance,
+        "unionFee": union_fee,
+        "overtimePayNonPIT": overtime_pay_non_pit,
+        "heSo": he_so,
+    }
+
+
+@lru_cache(maxsize=None)
+def _load_sample_info() -> dict:
+    """Sample values from sample_info.json (defaults if missing), read once"""
+    # Load sample data from JSON file
+    json_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'sample_info.json')
+    
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Warning: {json_path} not found, using default values")
+        return {
+            "salary": 10000000,
+            "bonus": 500000,
+            "dependants": 1,
+            "personalRelief": 11000000,
+            "dependentRelief": 4400000,
+            "ot15": 10,
+            "ot20": 5,
+            "ot30": 2,
+            "allowanceTax": 200000,
+            "advance": 0
+        }
+    except json.JSONDecodeError as e:
+        print(f"Warning: Error parsing {json_path}: {e}, using default values")
+        return {
+            "salary": 10000000,
+            "bonus": 500000,
+            "dependants": 1,
+            "personalRelief": 11000000,
+            "dependentRelief": 4400000,
+            "ot15": 10,
+            "ot20": 5,
+            "ot30": 2,
+            "allowanceTax": 200000,
+            "advance": 0
+        }
 
 
 class MemStorage:
     """Memory storage implementation for salary calculations and employee data"""
     
+    # Sample employees as first calculated; later resets copy them instead of
+    # reading sample_info.json and recalculating
+    _sample_employees: Optional[List[SelectEmployee]] = None
+    
     def __init__(self):
         """Initialize storage with empty dictionaries and seed data"""
         self.employees: Dict[str, SelectEmployee] = {}
@@ -29,40 +146,17 @@ class MemStorage:
     
     def _initialize_sample_employees(self):
         """Initialize storage with sample employee from JSON file"""
-        # Load sample data from JSON file
-        json_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'sample_info.json')
+        if MemStorage._sample_employees is None:
+            MemStorage._sample_employees = self._build_sample_employees()
         
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                sample_info = json.load(f)
-        except FileNotFoundError:
-            print(f"Warning: {json_path} not found, using default values")
-            sample_info = {
-                "salary": 10000000,
-                "bonus": 500000,
-                "dependants": 1,
-                "personalRelief": 11000000,
-                "dependentRelief": 4400000,
-                "ot15": 10,
-                "ot20": 5,
-                "ot30": 2,
-                "allowanceTax": 200000,
-                "advance": 0
-            }
-        except json.JSONDecodeError as e:
-            print(f"Warning: Error parsing {json_path}: {e}, using default values")
-            sample_info = {
-                "salary": 10000000,
-                "bonus": 500000,
-                "dependants": 1,
-                "personalRelief": 11000000,
-                "dependentRelief": 4400000,
-                "ot15": 10,
-                "ot20": 5,
-                "ot30": 2,
-                "allowanceTax": 200000,
-                "advance": 0
-            }
+        calculated_at = datetime.now().isoformat()
+        for sample in MemStorage._sample_employees:
+            self.employees[sample.id] = sample.model_copy(update={"calculatedAt": calculated_at})
+    
+    @staticmethod
+    def _build_sample_employees() -> List[SelectEmployee]:
+        """Calculate the sample employees"""
+        sample_info = _load_sample_info()
         
         # Create sample employee with loaded data
         sample_data = [
@@ -80,80 +174,27 @@ class MemStorage:
             }
         ]
         
-        for i, data in enumerate(sample_data, 1):
-            # Calculate derived values
-            aug_salary = round((data["salary"] / 21) * 20)
-            overtime_pay_pit = int((aug_salary / 22 / 8) * (data["ot15"] + data["ot20"] + data["ot30"]))
-            total_salary = round(aug_salary + data["bonus"] + data["allowanceTax"] + overtime_pay_pit)
-            
-            personal_relief = 11000000
-            dependent_relief = 4400000 * data["dependants"]
-            company_insurance = data["salary"] * 0.215  # Company pays 21.5%
-            employee_insurance = data["salary"] * 0.105
-            union_fee = min(data["salary"] * 0.005, 234000)
-            
-            he_so = data["ot15"] * 0.5 + data["ot20"] + data["ot30"] * 2
-            overtime_pay_non_pit = round((aug_salary / 22 / 8) * he_so)
-            
-            assessable_income = max(0, total_salary - (employee_insurance + personal_relief + dependent_relief))
-            
-            # Calculate progressive tax using tax brackets
-            tax_brackets = [
-                {"limit": 5000000, "rate": 0.05, "deduction": 0},
-                {"limit": 10000000, "rate": 0.10, "deduction": 250000},
-                {"limit": 18000000, "rate": 0.15, "deduction": 750000},
-                {"limit": 32000000, "rate": 0.20, "deduction": 1650000},
-                {"limit": 52000000, "rate": 0.25, "deduction": 3250000},
-                {"limit": 80000000, "rate": 0.30, "deduction": 5850000},
-                {"limit": float('inf'), "rate": 0.35, "deduction": 9850000},
-            ]
-            
-            personal_income_tax = 0
-            for bracket in tax_brackets:
-                if assessable_income <= bracket["limit"]:
-                    personal_income_tax = assessable_income * bracket["rate"] - bracket["deduction"]
-                    break
-            personal_income_tax = round(max(personal_income_tax, 0))
-            
-            # Calculate total OT hours (matching the form's calculation)
-            total_ot_hours = round(data["ot15"] + data["ot20"] + data["ot30"] + he_so)
-            
-            total_net_income = round(total_salary - personal_income_tax - employee_insurance - 
-                                   union_fee + overtime_pay_non_pit - data["advance"])
-            
+        # Calculate derived values for all sample employees at once
+        values = np.array([[data[field] for field in _PAYROLL_INPUTS] for data in sample_data], dtype=np.float64).T
+        calculated = {field: column.tolist() for field, column in _compute_payroll(values).items()}
+        calculated_at = datetime.now().isoformat()
+        
+        employees = []
+        for i, data in enumerate(sample_data):
             # Create employee with all calculated fields
             employee = SelectEmployee(
-                id=f"sample-{i:03d}",
+                id=f"sample-{i + 1:03d}",
                 employeeNo=data["employeeNo"],
                 name=data["name"],
-                augSalary=aug_salary,
-                totalOTHours=total_ot_hours,
-                totalNetIncome=total_net_income,
-                salary=data["salary"],
-                bonus=data["bonus"],
-                allowanceTax=data["allowanceTax"],
-                ot15=data["ot15"],
-                ot20=data["ot20"],
-                ot30=data["ot30"],
-                dependants=data["dependants"],
-                advance=data["advance"],
+                **{field: data[field] for field in _PAYROLL_INPUTS},
+                **{field: column[i] for field, column in calculated.items()},
                 actualDaysWorked=20,
                 totalWorkdays=20,
-                overtimePayPIT=overtime_pay_pit,
-                totalSalary=total_salary,
-                personalRelief=personal_relief,
-                dependentRelief=dependent_relief,
-                assessableIncome=assessable_income,
-                personalIncomeTax=personal_income_tax,
-                companyInsurance=company_insurance,
-                employeeInsurance=employee_insurance,
-                unionFee=union_fee,
-                overtimePayNonPIT=overtime_pay_non_pit,
-                heSo=he_so,
-                calculatedAt=datetime.now().isoformat()
+                calculatedAt=calculated_at
             )
             
-            self.employees[employee.id] = employee
+            employees.append(employee)
+        return employees
     
     # Employee management methods
     def addEmployee(self, employee: InsertEmployee) -> SelectEmployee:
@@ -183,11 +224,10 @@ class MemStorage:
         # Only update fields that are provided (not None)
         update_data = data.model_dump(exclude_none=True)
         
-        # Create updated employee by merging existing data with updates
-        updated_dict = existing.model_dump()
-        updated_dict.update(update_data)
-        
-        updated_employee = SelectEmployee(**updated_dict)
+        # Copy the existing employee with the updates applied; the values were
+        # already validated by EmployeeUpdate (same field types), so the
+        # unchanged fields don't need to be dumped and validated again
+        updated_employee = existing.model_copy(update=update_data)
         self.employees[employee_id] = updated_employee
         return updated_employee
     
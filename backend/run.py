@@ -32,7 +32,9 @@ if __name__ == "__main__":
         print(f"API Documentation: http://localhost:{port}/docs")
         print(f"Alternative docs: http://localhost:{port}/redoc")
     
-    # Run the server
+    # Run the server. The default "auto" loop and http settings pick uvloop
+    # and httptools when they're installed; a single process is kept because
+    # the employee and calculation storage lives in memory.
     uvicorn.run(
         app,
         host=host,
@@ -41,6 +43,7 @@ if __name__ == "__main__":
         log_level=log_level,
         # Use colors in terminal output
         use_colors=True,
-        # Access log format
-        access_log=True,
+        # LoggingMiddleware already logs API requests; uvicorn's own
+        # per-request access log is only kept in development
+        access_log=is_development(),
     )
\ No newline at end of file